@@ -0,0 +1,130 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Per-channel totals and per-video daily series, maintained incrementally.
+
+`channel_stats` holds a channel's ready videos, views, likes and
+subscribers; `video_daily_stats` the views and net likes of a video per
+day, with the channel copied in so a channel's series is one index range.
+Publishing a video, flushing the view buffer, liking and (un)subscribing
+add their deltas here as upserts in the caller's transaction, so analytics
+pages read a few precomputed rows instead of counting videos, likes and
+subscriptions. Each delta also invalidates the channel's
+`channel-stats:<user>` cache tag, which the channel header is cached under.
+
+Views are dated when the view buffer is flushed, which is within
+`VIEW_FLUSH_INTERVAL` of the view except for logs replayed after a crash.
+`flask rebuild-analytics` recomputes the totals from the source tables;
+daily series have no source to be rebuilt from.
+"""
+
+from datetime import date, timedelta
+
+from sqlalchemy import bindparam, delete, func, insert, select, text
+
+import cache
+from models import db, ChannelStats, Like, Subscription, User, Video, VideoDailyStats
+
+_CHANNEL_CONFLICT = (
+    'ON CONFLICT (user_id) DO UPDATE SET '
+    'video_count = channel_stats.video_count + excluded.video_count, '
+    'views = channel_stats.views + excluded.views, '
+    'likes = channel_stats.likes + excluded.likes, '
+    'subscribers = channel_stats.subscribers + excluded.subscribers'
+)
+CHANNEL_DELTA = text(
+    'INSERT INTO channel_stats (user_id, video_count, views, likes, subscribers) '
+    'VALUES (:user_id, :video_count, 0, 0, :subscribers) ' + _CHANNEL_CONFLICT)
+CHANNEL_DELTA_BY_VIDEO = text(
+    'INSERT INTO channel_stats (user_id, video_count, views, likes, subscribers) '
+    'SELECT user_id, 0, :views, :likes, 0 FROM video WHERE video_id = :video_id ' + _CHANNEL_CONFLICT)
+DAILY_DELTA = text(
+    'INSERT INTO video_daily_stats (video_id, day, user_id, views, likes) '
+    'SELECT video_id, :day, user_id, :views, :likes FROM video WHERE video_id = :video_id '
+    'ON CONFLICT (video_id, day) DO UPDATE SET '
+    'views = video_daily_stats.views + excluded.views, '
+    'likes = video_daily_stats.likes + excluded.likes'
+).bindparams(bindparam('day', type_=db.Date))
+
+
+def _invalidate(*user_ids):
+    cache.invalidate(*(f'channel-stats:{user_id}' for user_id in user_ids))
+
+
+def _video_deltas(deltas):
+    """Add `{video_id: (views, likes)}` to the channel totals and today's buckets. The caller commits."""
+    params = [{'video_id': video_id, 'views': views, 'likes': likes, 'day': date.today()}
+              for video_id, (views, likes) in deltas.items()]
+    if params:
+        db.session.execute(CHANNEL_DELTA_BY_VIDEO, params)
+        db.session.execute(DAILY_DELTA, params)
+        _invalidate(*db.session.scalars(select(Video.user_id).where(Video.video_id.in_(deltas)).distinct()))
+
+
+def record_views(counts):
+    """`counts` maps video ids to views, as flushed by the view buffer."""
+    _video_deltas({video_id: (count, 0) for video_id, count in counts.items()})
+
+
+def record_like(video_id, delta):
+    _video_deltas({video_id: (0, delta)})
+
+
+def record_upload(user_id):
+    """Count a video that just became ready."""
+    db.session.execute(CHANNEL_DELTA, {'user_id': user_id, 'video_count': 1, 'subscribers': 0})
+    _invalidate(user_id)
+
+
+def record_subscription(user_id, delta):
+    db.session.execute(CHANNEL_DELTA, {'user_id': user_id, 'video_count': 0, 'subscribers': delta})
+    _invalidate(user_id)
+
+
+def channel_totals(user_id):
+    stats = db.session.get(ChannelStats, user_id)
+    if stats is None:
+        return ChannelStats(user_id=user_id, video_count=0, views=0, likes=0, subscribers=0)
+    return stats
+
+
+def _series(filter_, days):
+    """`days` consecutive days up to today as dicts, with days without activity as zeros."""
+    first = date.today() - timedelta(days=days - 1)
+    rows = db.session.query(VideoDailyStats.day, func.sum(VideoDailyStats.views), func.sum(VideoDailyStats.likes)) \
+        .filter(filter_, VideoDailyStats.day >= first).group_by(VideoDailyStats.day).all()
+    totals = {day: (views, likes) for day, views, likes in rows}
+    series = []
+    for offset in range(days):
+        day = first + timedelta(days=offset)
+        views, likes = totals.get(day, (0, 0))
+        series.append({'day': day.isoformat(), 'views': int(views), 'likes': int(likes)})
+    return series
+
+
+def channel_series(user_id, days):
+    return _series(VideoDailyStats.user_id == user_id, days)
+
+
+def video_series(video_id, days):
+    return _series(VideoDailyStats.video_id == video_id, days)
+
+
+def rebuild():
+    """Recompute every channel's totals from the video, like and subscription tables."""
+    ready = Video.status == Video.STATUS_READY
+    db.session.execute(delete(ChannelStats))
+    db.session.execute(insert(ChannelStats).from_select(
+        ['user_id', 'video_count', 'views', 'likes', 'subscribers'],
+        select(
+            User.id,
+            select(func.count()).where(Video.user_id == User.id, ready).scalar_subquery(),
+            select(func.coalesce(func.sum(Video.views), 0)).where(Video.user_id == User.id, ready)
+            .scalar_subquery(),
+            select(func.count()).select_from(Like).join(Video, Video.video_id == Like.video_id)
+            .where(Video.user_id == User.id).scalar_subquery(),
+            select(func.count()).where(Subscription.subscribed_to_id == User.id).scalar_subquery(),
+        )))
+    db.session.commit()
@@ -5,37 +5,166 @@
 
 
 
+import base64
+import io
+import ipaddress
+import mimetypes
 import os
-import random
-import subprocess
 import uuid
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory
+from markupsafe import Markup
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, abort
 from flask_limiter.util import get_remote_address
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from sqlalchemy import or_
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from PIL import Image
 from flask_limiter import Limiter
 
+import analytics
+from blocklist import Blocklist, PrefixTrie, parse_networks
+import cache
+import database
+import feeds
+from database import read_replica
+from delivery import send_media
 from forms import LoginForm, RegistrationForm
-from models import db, User, Video, Like
+import loaders
+from loaders import get_viewer, query_count
+from media import MEZZANINE_NAME, THUMBNAIL_WIDTHS
+import metrics
+from models import db, User, Video, Like, UploadSession, reconcile_counters
+import passwords
+from passwords import HashingBusy
+import ratelimit  # noqa: F401  Registers the sqlite:// limiter storage
+import recommendations
+import renditions
+import search
+import storage
+from tasks import TranscodeWorker, enqueue_transcode
+import uploads
+from uploads import UploadError
+from viewcount import ViewBuffer
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
+# Engine settings, see database.py. Read-only pages use the replica when one is configured
+app.config['DATABASE_REPLICA_URL'] = os.environ.get('DATABASE_REPLICA_URL')
+app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+app.config['DATABASE_MAX_OVERFLOW'] = int(os.environ.get('DATABASE_MAX_OVERFLOW', 20))
+app.config['DATABASE_POOL_TIMEOUT'] = 10
+app.config['DATABASE_POOL_RECYCLE'] = 1800
+app.config['SQLITE_BUSY_TIMEOUT'] = 5000  # ms
+app.config['SQLITE_MMAP_SIZE'] = 256 * 1024 * 1024
 app.config['SECRET_KEY'] = ''
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
+# Renditions and mezzanines. Kept out of static/: they are only served through the
+# media route, which refuses mezzanines and staging directories
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', os.path.join(app.instance_path, 'media'))
 app.config['UPLOAD_AVATAR_FOLDER'] = 'static/avatars'
 app.config['THUMBNAIL_FOLDER'] = 'static/thumbnails'
 app.config['ALLOWED_EXTENSIONS'] = {'mp4', 'mov', 'avi', 'mkv'}
 app.config['VIDEO_QUALITIES'] = ['1080p', '720p', '480p', '360p']
+# Cap on ffmpeg pipelines running at once, independent of the number of web workers
+app.config['TRANSCODE_WORKERS'] = int(os.environ.get('TRANSCODE_WORKERS', 2))
+app.config['TRANSCODE_POLL_INTERVAL'] = 2.0
+app.config['TRANSCODE_MAX_ATTEMPTS'] = 2
+# A worker renews the lease of its running jobs every quarter of this; jobs whose
+# lease ran out are taken to belong to a dead worker and are queued again
+app.config['TRANSCODE_LEASE_SECONDS'] = 120
+# Thread budget for one transcode (0 lets ffmpeg use every core) and
+# per-rendition overrides of media.DEFAULT_PRESETS, e.g. {'4K': {'preset': 'veryfast', 'crf': '24'}}
+app.config['TRANSCODE_THREADS'] = int(os.environ.get('TRANSCODE_THREADS', 0))
+app.config['TRANSCODE_PRESETS'] = {}
+app.config['HLS_SEGMENT_SECONDS'] = 6
+# 'on_demand' encodes only TRANSCODE_DEFAULT_QUALITY at upload and keeps the source;
+# other rungs are encoded when first played and evicted past the budget, see renditions.py
+app.config['TRANSCODE_MODE'] = os.environ.get('TRANSCODE_MODE', 'eager')
+app.config['TRANSCODE_DEFAULT_QUALITY'] = '720p'
+app.config['RENDITION_CACHE_BUDGET'] = int(os.environ.get('RENDITION_CACHE_BUDGET', 50 * 1024 ** 3))
+app.config['RENDITION_RETRY_AFTER'] = 10
+app.config['RENDITION_TOUCH_SECONDS'] = 300
+# Resumable uploads, see uploads.py
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024
+app.config['UPLOAD_MAX_SIZE'] = 16 * 1024 ** 3
+app.config['UPLOAD_SESSION_TTL'] = 24 * 3600
+# Sources waiting for the transcoder and resumable uploads in progress, never served
+app.config['UPLOAD_SESSION_FOLDER'] = os.path.join(app.instance_path, 'uploads')
+app.config['FEED_PAGE_SIZE'] = 24
+app.config['SEARCH_PAGE_SIZE'] = 24
+app.config['SEARCH_CHANNEL_LIMIT'] = 12
+# Views are written to the database in batches, see viewcount.py
+app.config['VIEW_FLUSH_INTERVAL'] = 5.0
+app.config['VIEW_FLUSH_EVENTS'] = 500
+app.config['VIEW_LOG_FOLDER'] = os.path.join(app.instance_path, 'viewlog')
+app.config['FRAGMENT_CACHE_ENABLED'] = True
+app.config['FRAGMENT_CACHE_SIZE'] = 5000
+app.config['FRAGMENT_CACHE_TTL'] = 300
+app.config['FRAGMENT_TAG_SYNC_SECONDS'] = 1.0
+# Logged-in user snapshots, see loaders.load_user
+app.config['USER_CACHE_SIZE'] = 10000
+app.config['USER_CACHE_TTL'] = 60
+# Days shown by the channel and video analytics, see analytics.py
+app.config['ANALYTICS_DAYS'] = 30
+# Subscriptions feed, see feeds.py
+app.config['FEED_HEAD_SIZE'] = 240
+app.config['FEED_CHANNEL_CHUNK'] = 500
+app.config['FEED_CACHE_SIZE'] = 10000
+app.config['FEED_CACHE_TTL'] = 300
+app.config['RECOMMENDATION_K'] = 40
+app.config['RECOMMENDATION_REFRESH_SECONDS'] = 600
+app.config['SUGGESTED_VIDEOS'] = 20
+# Password hashing, see passwords.py. Any werkzeug method string works here
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_SALT_LENGTH'] = 16
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE'] = 16
+app.config['PASSWORD_HASH_WAIT'] = 2.0
+# Rate-limit counters shared by all workers: a SQLite file on one host, redis://... across hosts
+app.config['RATELIMIT_STORAGE_URI'] = os.environ.get(
+    'RATELIMIT_STORAGE_URI', 'sqlite:///' + os.path.join(app.instance_path, 'ratelimit.db'))
+app.config['RATELIMIT_STRATEGY'] = 'sliding-window-counter'
+# Blocked addresses and CIDR ranges, see blocklist.py
+app.config['BLOCKED_NETWORKS'] = ['192.168.1.100', '192.168.1.101']
+app.config['BLOCKLIST_FILE'] = os.path.join(app.instance_path, 'blocklist.txt')
+app.config['BLOCKLIST_RELOAD_SECONDS'] = 5.0
+# Instrumentation, see metrics.py. /metrics answers only to these networks
+app.config['METRICS_FOLDER'] = os.path.join(app.instance_path, 'metrics')
+app.config['METRICS_FLUSH_SECONDS'] = 5.0
+app.config['METRICS_ALLOWED_NETWORKS'] = ['127.0.0.0/8', '::1', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16']
+# Dump a flame graph of requests slower than this many seconds (None disables the profiler)
+app.config['PROFILE_SLOW_REQUESTS'] = float(os.environ['PROFILE_SLOW_REQUESTS']) \
+    if os.environ.get('PROFILE_SLOW_REQUESTS') else None
+app.config['PROFILE_INTERVAL'] = 0.005
+app.config['PROFILE_FOLDER'] = os.path.join(app.instance_path, 'profiles')
+# Upper bound on SQL statements per request, checked by tests/test_query_budgets.py
+app.config['QUERY_BUDGETS'] = {
+    'home': 7,
+    'feed_api': 3,
+    'search_api': 4,
+    'view_video': 6,
+    'view_channel': 6,
+    'liked_videos': 4,
+}
+database.configure(app)
 db.init_app(app)
+database.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
-migrate = Migrate(app, db)
+# Batch mode lets migrations alter SQLite tables
+migrate = Migrate(app, db, render_as_batch=True)
+view_buffer = ViewBuffer(app)
+cache.init_app(app)
+storage.init_app(app)
+blocklist = Blocklist()
+blocklist.init_app(app)
+metrics.init_app(app)
+metrics_networks = PrefixTrie()
+for network in parse_networks(app.config['METRICS_ALLOWED_NETWORKS']):
+    metrics_networks.add(network)
 
 limiter = Limiter(
     get_remote_address,
@@ -43,7 +172,11 @@ limiter = Limiter(
     default_limits=["200 per day", "50 per hour"]
 )
 
-BLOCKED_IPS = {'192.168.1.100', '192.168.1.101'}
+# HLS playlists and fMP4 segments served from UPLOAD_FOLDER
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/iso.segment', '.m4s')
+mimetypes.add_type('image/webp', '.webp')
+mimetypes.add_type('text/vtt', '.vtt')
 
 # Create directories if they do not exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -52,124 +185,67 @@ os.makedirs(app.config['THUMBNAIL_FOLDER'], exist_ok=True)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return loaders.load_user(int(user_id))
 
 
 @app.before_request
 def block_method():
-    if request.remote_addr in BLOCKED_IPS:
+    if blocklist.is_blocked(request.remote_addr):
         return "Your IP has been blocked.", 403
 
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+@app.template_global()
+def thumbnail_srcset(video, extension):
+    return ', '.join(
+        f"{url_for('static', filename=f'thumbnails/{video.thumbnail_dir}/{width}.{extension}')} {width}w"
+        for width in THUMBNAIL_WIDTHS)
 
 
-def generate_thumbnail(video_path, thumbnail_path):
-    ffmpeg_path = r"C:\ffmpeg\bin\ffmpeg.exe"
-    command = [
-        ffmpeg_path,
-        '-i', video_path,
-        '-ss', '00:00:01.000',
-        '-vframes', '1',
-        '-vf', 'scale=320:-1',
-        thumbnail_path
-    ]
-    subprocess.run(command, capture_output=True)
-
-
-def get_video_resolution(video_path):
-    ffprobe_path = r"C:\ffmpeg\bin\ffprobe.exe"
-    command = [
-        ffprobe_path,
-        '-v', 'error',
-        '-select_streams', 'v:0',
-        '-count_packets', '-show_entries', 'stream=width,height',
-        '-of', 'csv=p=0',
-        video_path
-    ]
-    output = subprocess.check_output(command).decode('utf-8').strip().split(',')
-    return int(output[0]), int(output[1])
-
-
-def generate_video_variants(video_path, base_filename):
-    ffmpeg_path = r"C:\ffmpeg\bin\ffmpeg.exe"
-    variants = {}
-    qualities = {
-        '4K': '3840x2160',
-        'QHD': '2560x1440',
-        '1080p': '1920x1080',
-        '720p': '1280x720',
-        '480p': '854x480',
-        '360p': '640x360'
-    }
+@app.template_global()
+def cached_video_card(video):
+    """Feed card HTML, cached until the video or its channel changes or the date label rolls over."""
+    return cache.render_fragment(
+        '_video_card.html',
+        f'card:{video.video_id}:{video.formatted_upload_date}',
+        [f'video:{video.video_id}', f'channel:{video.user_id}'],
+        time_since_valid_for(video.created_at),
+        video=video,
+    )
 
-    original_width, original_height = get_video_resolution(video_path)
-    aspect_ratio = original_width / original_height
 
-    for quality, resolution in qualities.items():
-        target_width, target_height = map(int, resolution.split('x'))
+@app.context_processor
+def inject_viewer():
+    return {'viewer': get_viewer()}
 
-        if original_width >= target_width or original_height >= target_height:
-            variant_filename = f"{base_filename}_{quality}.mp4"
-            variant_path = os.path.join(app.config['UPLOAD_FOLDER'], variant_filename)
 
-            if abs(aspect_ratio - 1) < 0.01:  # Square video
-                # Find the closest larger resolution
-                if original_width <= target_width and original_height <= target_height:
-                    new_size = max(original_width, original_height)
-                    filter_complex = f'scale={new_size}:{new_size},pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2'
-            elif abs(aspect_ratio - (target_width / target_height)) < 0.01:
-                # Standard aspect ratio, just scale
-                filter_complex = f'scale={target_width}:{target_height}'
-            else:
-                # Non-standard aspect ratio, scale and pad
-                if aspect_ratio > 1:  # Landscape
-                    new_height = int(target_width / aspect_ratio)
-                    filter_complex = f'scale={target_width}:{new_height},pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2'
-                else:  # Portrait
-                    new_width = int(target_height * aspect_ratio)
-                    filter_complex = f'scale={new_width}:{target_height},pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2'
-
-            command = [
-                ffmpeg_path,
-                '-i', video_path,
-                '-vf', filter_complex,
-                '-c:v', 'libx264',
-                '-crf', '23',
-                '-preset', 'medium',
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                variant_path
-            ]
-
-            subprocess.run(command, capture_output=True)
-            variants[quality] = variant_filename
-
-    return variants
-
-
-def get_video_duration(video_path):
-    """Returns the duration of the video in 'MM:SS' format, or 'HH:MM:SS' if longer than an hour."""
-    ffprobe_path = r"C:\ffmpeg\bin\ffprobe.exe"
-    command = [
-        ffprobe_path,
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        video_path
-    ]
-    result = subprocess.run(command, capture_output=True, text=True)
-    duration_seconds = float(result.stdout.strip())
-
-    # Calculate hours, minutes, and seconds
-    hours, remainder = divmod(int(duration_seconds), 3600)
-    minutes, seconds = divmod(remainder, 60)
-
-    if hours:
-        return f"{hours}:{minutes:02}:{seconds:02}"
-    else:
-        return f"{minutes}:{seconds:02}"
+@app.after_request
+def query_count_header(response):
+    if app.debug:
+        response.headers['X-Query-Count'] = str(query_count())
+    return response
+
+
+@app.after_request
+def cache_content_addressed(response):
+    """Static files stored under their content hash never change, see storage.py."""
+    if request.endpoint == 'static' and response.status_code == 200:
+        filename = request.view_args['filename']
+        if any(filename.startswith(folder + '/') and storage.is_content_addressed(filename[len(folder) + 1:])
+               for folder in ('avatars', 'thumbnails')):
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+    return response
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+
+
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
 
 
 @app.route('/favicon.ico')
@@ -177,6 +253,38 @@ def favicon():
     return url_for('static', filename='favicon.ico')
 
 
+@app.route('/media/<path:filename>', methods=['GET', 'HEAD'])
+@limiter.exempt
+def media(filename):
+    name = os.path.basename(filename)
+    if name == MEZZANINE_NAME or '/.' in f'/{filename}':
+        abort(404)
+    if name.endswith('.m3u8') and name != 'master.m3u8':
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if path is not None and os.path.isfile(path):
+            renditions.touch(filename)
+        elif renditions.request(filename):
+            db.session.commit()
+            # Players retry later or stay on a rung they already have
+            return 'Это качество ещё готовится', 503, {'Retry-After': str(app.config['RENDITION_RETRY_AFTER'])}
+    # Next to a mezzanine, rungs may be evicted and encoded again
+    mezzanine = safe_join(app.config['UPLOAD_FOLDER'], os.path.dirname(filename), MEZZANINE_NAME)
+    materialized = mezzanine is not None and not os.path.isfile(mezzanine)
+    return send_media(app.config['UPLOAD_FOLDER'], filename, materialized=materialized)
+
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    try:
+        address = ipaddress.ip_address(request.remote_addr)
+    except ValueError:
+        abort(403)
+    if address not in metrics_networks:
+        abort(403)
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegistrationForm()
@@ -184,11 +292,11 @@ def register():
         avatar_filename = None
         if form.avatar.data:
             avatar_file = form.avatar.data
-            avatar_filename = secure_filename(f"{uuid.uuid4().hex}_{avatar_file.filename}")
-            avatar_path = os.path.join(app.config['UPLOAD_AVATAR_FOLDER'], avatar_filename)
-            avatar_file.save(avatar_path)
+            extension = os.path.splitext(secure_filename(avatar_file.filename))[1]
+            avatar_filename = storage.save(avatar_file.stream, 'avatar', extension)
+            storage.acquire('avatar', avatar_filename)
 
-        hashed_password = generate_password_hash(form.password.data)
+        hashed_password = passwords.hash_password(form.password.data)
         new_user = User(
             username=form.username.data,
             email=form.email.data,
@@ -198,6 +306,8 @@ def register():
             channel_description=form.username.data
         )
         db.session.add(new_user)
+        db.session.flush()
+        search.index_channel(new_user)
         db.session.commit()
         flash('Your account has been created!', 'success')
         return redirect(url_for('login'))
@@ -209,7 +319,10 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user and check_password_hash(user.password_hash, form.password.data):
+        if user and passwords.check_password(user.password_hash, form.password.data):
+            if passwords.needs_rehash(user.password_hash):
+                user.password_hash = passwords.hash_password(form.password.data)
+                db.session.commit()
             login_user(user)
             flash('You have been logged in!', 'success')
             return redirect(url_for('home'))
@@ -218,6 +331,11 @@ def login():
     return render_template('login.html', form=form)
 
 
+@app.errorhandler(HashingBusy)
+def handle_hashing_busy(error):
+    return "Слишком много попыток входа, попробуйте через несколько секунд.", 503, {'Retry-After': '5'}
+
+
 @app.route('/update_avatar', methods=['POST'])
 @login_required
 def update_avatar():
@@ -231,12 +349,10 @@ def update_avatar():
         return redirect(request.referrer or url_for('home'))
 
     if avatar_file:
-        filename = secure_filename(f"{uuid.uuid4().hex}_{avatar_file.filename}")
-        avatar_path = os.path.join(app.config['UPLOAD_AVATAR_FOLDER'], filename)
-        avatar_file.save(avatar_path)
+        extension = os.path.splitext(secure_filename(avatar_file.filename))[1].lower()
 
         # Process the image to make it square
-        with Image.open(avatar_path) as img:
+        with Image.open(avatar_file.stream) as img:
             # Calculate the size of the square
             min_side = min(img.size)
             left = (img.width - min_side) / 2
@@ -248,10 +364,19 @@ def update_avatar():
             img = img.crop((left, top, right, bottom))
             img = img.resize((256, 256), Image.LANCZOS)  # Resize to desired size
 
-            # Save the processed image
-            img.save(avatar_path)
-
+            # Store the processed image under its content hash
+            image_format = Image.registered_extensions().get(extension)
+            if image_format is None:
+                extension, image_format = '.png', 'PNG'
+            processed = io.BytesIO()
+            img.save(processed, format=image_format)
+            processed.seek(0)
+            filename = storage.save(processed, 'avatar', extension)
+
+        storage.acquire('avatar', filename)
+        storage.release('avatar', current_user.avatar_filename)
         current_user.avatar_filename = filename
+        cache.invalidate(f'channel:{current_user.id}', f'user:{current_user.id}')
         db.session.commit()
 
         flash('Avatar updated successfully!', 'success')
@@ -261,25 +386,27 @@ def update_avatar():
         return redirect(request.referrer or url_for('home'))
 
 
+# Time units used by time_since and corresponding strings
+TIME_UNITS = [
+    (timedelta(days=365), 'год', 'года', 'лет'),
+    (timedelta(days=30), 'месяц', 'месяца', 'месяцев'),
+    (timedelta(days=1), 'день', 'дня', 'дней'),
+    (timedelta(hours=1), 'час', 'часа', 'часов'),
+    (timedelta(minutes=1), 'минуту', 'минуты', 'минут'),
+]
+
+
+@metrics.timed
 def time_since(past_datetime):
     now = datetime.now()
     diff = now - past_datetime
 
-    # Define time units and corresponding strings
-    time_units = [
-        (timedelta(days=365), 'год', 'года', 'лет'),
-        (timedelta(days=30), 'месяц', 'месяца', 'месяцев'),
-        (timedelta(days=1), 'день', 'дня', 'дней'),
-        (timedelta(hours=1), 'час', 'часа', 'часов'),
-        (timedelta(minutes=1), 'минуту', 'минуты', 'минут'),
-        (timedelta(seconds=1), 'секунду', 'секунды', 'секунд'),
-    ]
-
-    # If the difference is less than 1 second
-    if diff < timedelta(seconds=1):
+    # Anything under a minute is bucketed into 'Только что', so a rendered
+    # label is always valid for at least a minute (see time_since_valid_for)
+    if diff < TIME_UNITS[-1][0]:
         return 'Только что'
 
-    for delta, singular, few, many in time_units:
+    for delta, singular, few, many in TIME_UNITS:
         if diff >= delta:
             count = int(diff / delta)
             if count == 1:
@@ -296,53 +423,180 @@ def time_since(past_datetime):
     return 'Время не определено'
 
 
+def time_since_valid_for(past_datetime):
+    """Seconds until time_since(past_datetime) returns a different label."""
+    diff = datetime.now() - past_datetime
+    for delta, *_ in TIME_UNITS:
+        if diff >= delta:
+            return (delta - diff % delta).total_seconds()
+    return (TIME_UNITS[-1][0] - diff).total_seconds()
+
+
+def encode_cursor(video):
+    raw = f"{video.created_at.isoformat()}|{video.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, video_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(video_id)
+    except ValueError:
+        abort(400)
+
+
+def feed_page(cursor=None):
+    """Return one page of ready videos, newest first, and the cursor of the next page.
+
+    Keyset pagination on (created_at, id): the cost of a page does not depend
+    on how deep into the feed it is or how many videos exist.
+    """
+    page_size = app.config['FEED_PAGE_SIZE']
+    videos = Video.query.filter_by(status=Video.STATUS_READY).options(joinedload(Video.user))
+    if cursor:
+        created_at, video_id = decode_cursor(cursor)
+        videos = videos.filter(or_(
+            Video.created_at < created_at,
+            and_(Video.created_at == created_at, Video.id < video_id)
+        ))
+    videos = videos.order_by(Video.created_at.desc(), Video.id.desc()).limit(page_size + 1).all()
+
+    next_cursor = encode_cursor(videos[page_size - 1]) if len(videos) > page_size else None
+    videos = videos[:page_size]
+    for video in videos:
+        video.formatted_upload_date = time_since(video.created_at)
+    return videos, next_cursor
+
+
+def subscriptions_page(cursor=None):
+    """One page of the current user's subscriptions feed and the cursor of the next page."""
+    videos, has_more = feeds.page(current_user.id, decode_cursor(cursor) if cursor else None)
+    next_cursor = encode_cursor(videos[-1]) if has_more and videos else None
+    for video in videos:
+        video.formatted_upload_date = time_since(video.created_at)
+    return videos, next_cursor
+
+
+def video_card(video):
+    """JSON shape of a feed card, mirrors the markup in home.html."""
+    avatar = video.user.avatar_filename or 'def-avatar.png'
+    return {
+        'video_id': video.video_id,
+        'url': url_for('view_video', video_id=video.video_id),
+        'title': video.title,
+        'thumbnail_url': url_for('static', filename='thumbnails/' + video.thumbnail_filename),
+        'thumbnail_srcset': thumbnail_srcset(video, 'jpg') if video.thumbnail_dir else None,
+        'thumbnail_webp_srcset': thumbnail_srcset(video, 'webp') if video.thumbnail_dir else None,
+        'storyboard_url': url_for('static', filename='thumbnails/' + video.storyboard) if video.storyboard else None,
+        'duration': video.duration,
+        'views': video.views,
+        'uploaded': video.formatted_upload_date,
+        'channel_name': video.user.username,
+        'channel_avatar_url': url_for('static', filename='avatars/' + avatar),
+    }
+
+
+def search_page(query, page):
+    videos, has_more = search.search_videos(query, page, app.config['SEARCH_PAGE_SIZE'])
+    for video in videos:
+        video.formatted_upload_date = time_since(video.created_at)
+    return videos, has_more
+
+
+def request_page():
+    try:
+        return max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        abort(400)
+
+
 @app.route('/')
+@read_replica
 def home():
     query = request.args.get('query')
+    next_url = None
 
     if query:
-        videos = Video.query.join(User).filter(
-            or_(
-                Video.title.contains(query),
-                User.username.contains(query)
-            )
-        ).all()
+        page = request_page()
+        videos, has_more = search_page(query, page)
+        if has_more:
+            next_url = url_for('search_api', query=query, page=page + 1)
+        # Поиск каналов по запросу
+        channels = search.search_channels(query, app.config['SEARCH_CHANNEL_LIMIT']) if page == 1 else []
     else:
-        videos = Video.query.all()
+        videos, next_cursor = feed_page(request.args.get('cursor'))
+        if next_cursor:
+            next_url = url_for('feed_api', cursor=next_cursor)
+        channels = []
 
-    for video in videos:
-        video.formatted_upload_date = time_since(video.created_at)
+    return render_template('home.html', videos=videos, channels=channels, next_url=next_url, title="Owu")
 
-    # Поиск каналов по запросу
-    channels = User.query.filter(User.username.ilike(f'%{query}%')).all() if query else []
 
-    return render_template('home.html', videos=videos, channels=channels, title="Owu")
+@app.route('/api/feed')
+@read_replica
+def feed_api():
+    videos, next_cursor = feed_page(request.args.get('cursor'))
+    next_url = url_for('feed_api', cursor=next_cursor) if next_cursor else None
+    return jsonify(videos=[video_card(video) for video in videos], next_cursor=next_cursor, next_url=next_url)
+
+
+@app.route('/feed')
+@login_required
+@read_replica
+def subscriptions_feed():
+    videos, next_cursor = subscriptions_page(request.args.get('cursor'))
+    next_url = url_for('subscriptions_api', cursor=next_cursor) if next_cursor else None
+    return render_template('home.html', videos=videos, channels=[], next_url=next_url, title="Подписки")
+
+
+@app.route('/api/subscriptions')
+@login_required
+@read_replica
+def subscriptions_api():
+    videos, next_cursor = subscriptions_page(request.args.get('cursor'))
+    next_url = url_for('subscriptions_api', cursor=next_cursor) if next_cursor else None
+    return jsonify(videos=[video_card(video) for video in videos], next_cursor=next_cursor, next_url=next_url)
+
+
+@app.route('/api/search')
+@read_replica
+def search_api():
+    query = request.args.get('query', '')
+    page = request_page()
+    videos, has_more = search_page(query, page)
+    next_url = url_for('search_api', query=query, page=page + 1) if has_more else None
+    return jsonify(videos=[video_card(video) for video in videos], next_url=next_url)
 
 
 @app.route('/video/<video_id>')
 @limiter.limit("100 per minute")
 def view_video(video_id):
-    video = Video.query.filter_by(video_id=video_id).first_or_404()
-    suggested_videos = Video.query.filter(Video.video_id != video_id).all()
-
-    available_qualities = {
-        '2160p': url_for('static', filename=f'uploads/{video.filename_4k}') if video.filename_4k else None,
-        '1440p': url_for('static', filename=f'uploads/{video.filename_2k}') if video.filename_2k else None,
-        '1080p': url_for('static', filename=f'uploads/{video.filename_1080p}') if video.filename_1080p else None,
-        '720p': url_for('static', filename=f'uploads/{video.filename_720p}') if video.filename_720p else None,
-        '480p': url_for('static', filename=f'uploads/{video.filename_480p}') if video.filename_480p else None,
-        '360p': url_for('static', filename=f'uploads/{video.filename_360p}') if video.filename_360p else None,
-    }
-    available_qualities = {k: v for k, v in available_qualities.items() if v is not None}
+    video = Video.query.filter_by(video_id=video_id, status=Video.STATUS_READY) \
+        .options(joinedload(Video.user)).first_or_404()
+    recommendations.ensure_fresh(video)
+    suggested_html = cache.get_fragment(f'suggested:{video_id}')
+    if suggested_html is None:
+        suggested_videos = recommendations.suggested_videos(video, app.config['SUGGESTED_VIDEOS'])
+        for suggested_video in suggested_videos:
+            suggested_video.formatted_upload_date = time_since(suggested_video.created_at)
+        suggested_html = Markup(render_template('_suggested_videos.html', suggested_videos=suggested_videos))
+        tags = [f'recommendations:{video_id}']
+        for suggested_video in suggested_videos:
+            tags += [f'video:{suggested_video.video_id}', f'channel:{suggested_video.user_id}']
+        valid_for = min((time_since_valid_for(v.created_at) for v in suggested_videos), default=None)
+        cache.set_fragment(f'suggested:{video_id}', suggested_html, tags, valid_for)
+
+    available_qualities = {rendition.label: url_for('media', filename=rendition.path)
+                           for rendition in video.renditions}
+    hls_url = url_for('media', filename=video.hls_playlist) if video.hls_playlist else None
+    storyboard_url = url_for('static', filename='thumbnails/' + video.storyboard) if video.storyboard else None
 
     video.formatted_upload_date = time_since(video.created_at)
-    for videos in suggested_videos:
-        videos.formatted_upload_date = time_since(videos.created_at)
-
-    random.shuffle(suggested_videos)
 
-    return render_template('view_video.html', video=video, suggested_videos=suggested_videos,
-                           available_qualities=available_qualities)
+    return render_template('view_video.html', video=video, suggested_html=suggested_html,
+                           available_qualities=available_qualities, hls_url=hls_url,
+                           storyboard_url=storyboard_url)
 
 
 @app.route('/update_views', methods=['POST'])
@@ -350,9 +604,9 @@ def update_views():
     data = request.get_json()
     video_id = data.get('video_id')
 
-    video = Video.query.filter_by(video_id=video_id).first_or_404()
-    video.views += 1
-    db.session.commit()
+    if db.session.query(Video.id).filter_by(video_id=video_id).first() is None:
+        abort(404)
+    view_buffer.record(video_id)
 
     return jsonify({'success': True})
 
@@ -361,19 +615,13 @@ def update_views():
 @login_required
 def like_video(video_id):
     video = Video.query.filter_by(video_id=video_id).first_or_404()
-
-    existing_like = Like.query.filter_by(user_id=current_user.id, video_id=video_id).first()
-    if existing_like:
-        db.session.delete(existing_like)
-        video.likes -= 1
-    else:
-        new_like = Like(user_id=current_user.id, video_id=video_id)
-        db.session.add(new_like)
-        video.likes += 1
-
+    liked = current_user.toggle_like(video)
+    recommendations.mark_stale(video.video_id)
+    cache.invalidate(f'video:{video.video_id}')
     db.session.commit()
+    new_likes_count = db.session.query(Video.likes).filter_by(id=video.id).scalar()
 
-    return jsonify({'success': True, 'new_likes_count': video.likes})
+    return jsonify({'success': True, 'liked': liked, 'new_likes_count': new_likes_count})
 
 
 @app.route('/subscribe/<int:user_id>', methods=['POST'])
@@ -383,8 +631,9 @@ def subscribe(user_id):
         return jsonify(success=False, message="Вы не можете подписаться на самого себя.")
 
     user_to_subscribe = User.query.get_or_404(user_id)
-    if not current_user.is_subscribed(user_to_subscribe):
-        current_user.subscribe(user_to_subscribe)
+    if current_user.subscribe(user_to_subscribe):
+        recommendations.mark_channel_stale(user_to_subscribe.id)
+        cache.invalidate(f'channel:{user_to_subscribe.id}', f'subscriptions:{current_user.id}')
         db.session.commit()
 
     return jsonify(success=True, new_subscribers_count=user_to_subscribe.subscribers_count())
@@ -394,34 +643,79 @@ def subscribe(user_id):
 @login_required
 def unsubscribe(user_id):
     user_to_unsubscribe = User.query.get_or_404(user_id)
-    if current_user.is_subscribed(user_to_unsubscribe):
-        current_user.unsubscribe(user_to_unsubscribe)
+    if current_user.unsubscribe(user_to_unsubscribe):
+        recommendations.mark_channel_stale(user_to_unsubscribe.id)
+        cache.invalidate(f'channel:{user_to_unsubscribe.id}', f'subscriptions:{current_user.id}')
         db.session.commit()
 
     return jsonify(success=True, new_subscribers_count=user_to_unsubscribe.subscribers_count())
 
 
 @app.route('/channel/<int:user_id>')
+@read_replica
 def view_channel(user_id):
     # Получаем пользователя, чей канал просматривается
     viewed_user = User.query.get_or_404(user_id)
 
     # Получаем все видео, загруженные этим пользователем
-    videos = Video.query.filter_by(user_id=user_id).all()
+    videos = Video.query.filter_by(user_id=user_id, status=Video.STATUS_READY).all()
 
     for video in videos:
         video.formatted_upload_date = time_since(video.created_at)
 
+    channel_header = cache.get_fragment(f'channel-header:{user_id}')
+    if channel_header is None:
+        channel_header = Markup(render_template('_channel_header.html', viewed_user=viewed_user,
+                                                stats=analytics.channel_totals(user_id)))
+        cache.set_fragment(f'channel-header:{user_id}', channel_header,
+                           [f'channel:{user_id}', f'channel-stats:{user_id}'])
+
     # Передаем данные в шаблон
-    return render_template('view_channel.html', viewed_user=viewed_user, videos=videos)
+    return render_template('view_channel.html', viewed_user=viewed_user, videos=videos,
+                           channel_header=channel_header)
+
+
+def own_channel_analytics(user_id):
+    if user_id != current_user.id:
+        abort(403)
+    return analytics.channel_totals(user_id), analytics.channel_series(user_id, app.config['ANALYTICS_DAYS'])
+
+
+@app.route('/channel/<int:user_id>/analytics')
+@login_required
+@read_replica
+def channel_analytics(user_id):
+    stats, series = own_channel_analytics(user_id)
+    return render_template('channel_analytics.html', stats=stats, series=series, title="Аналитика канала")
+
+
+@app.route('/api/channel/<int:user_id>/analytics')
+@login_required
+@read_replica
+def channel_analytics_api(user_id):
+    stats, series = own_channel_analytics(user_id)
+    return jsonify(video_count=stats.video_count, views=stats.views, likes=stats.likes,
+                   subscribers=stats.subscribers, daily=series)
+
+
+@app.route('/api/video/<video_id>/analytics')
+@login_required
+@read_replica
+def video_analytics_api(video_id):
+    video = Video.query.filter_by(video_id=video_id).first_or_404()
+    if video.user_id != current_user.id:
+        abort(403)
+    return jsonify(video_id=video.video_id, views=video.views, likes=video.likes,
+                   daily=analytics.video_series(video_id, app.config['ANALYTICS_DAYS']))
 
 
 @app.route('/liked_videos')
 @limiter.limit("5 per minute")
 @login_required
 def liked_videos():
-    user = User.query.get_or_404(current_user.id)
-    liked_videos = [like.video for like in user.likes]
+    liked_videos = Video.query.join(Like, Like.video_id == Video.video_id) \
+        .filter(Like.user_id == current_user.id) \
+        .options(joinedload(Video.user)).all()
     for video in liked_videos:
         video.formatted_upload_date = time_since(video.created_at)
     return render_template('liked_videos.html', videos=liked_videos, title="Понравившиеся видео")
@@ -436,90 +730,214 @@ def upload():
         video_file = request.files.get('video')
 
         if not video_file:
-            flash('No video file selected.')
-            return redirect(request.url)
+            return upload_error('No video file selected.')
 
         if not allowed_file(video_file.filename):
-            flash('File type not allowed.')
-            return redirect(request.url)
+            return upload_error('File type not allowed.')
 
         video_id = uuid.uuid4().hex
-        base_filename = secure_filename(video_file.filename.rsplit('.', 1)[0])
-        unique_base_filename = f"{video_id}_{base_filename}"
-        video_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{unique_base_filename}.mp4")
+        video_path = os.path.join(app.config['UPLOAD_SESSION_FOLDER'], f"{video_id}.source")
 
         try:
-            with open(video_path, 'wb') as f:
-                while chunk := video_file.stream.read(1024 * 1024):
-                    f.write(chunk)
-
-            # Get the video duration
-            video_duration = get_video_duration(video_path)
-
-            # Generate video variants
-            variants = generate_video_variants(video_path, unique_base_filename)
-
-            # Handle thumbnail creation
-            thumbnail_file = request.files.get('thumbnail')
-            if thumbnail_file and thumbnail_file.filename:
-                thumbnail_filename = secure_filename(thumbnail_file.filename)
-                thumbnail_path = os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_filename)
-                thumbnail_file.save(thumbnail_path)
-            else:
-                thumbnail_filename = f"{unique_base_filename}.png"
-                thumbnail_path = os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_filename)
-                generate_thumbnail(video_path, thumbnail_path)
-
-            # Create and save the video object in the database
-            video = Video(
-                video_id=video_id,
-                title=title,
-                description=description,
-                filename_1080p=variants['1080p'],
-                filename_720p=variants['720p'],
-                filename_480p=variants['480p'],
-                filename_360p=variants['360p'],
-                thumbnail_filename=thumbnail_filename,
-                user_id=current_user.id,
-                duration=str(video_duration)  # Store the duration in a suitable format
-            )
-            db.session.add(video)
-            db.session.commit()
-            flash('Video and thumbnail uploaded successfully.')
-            if os.path.exists(video_path):
-                os.remove(video_path) # Remove the video file
-
-            return redirect(url_for('home'))
-
+            os.makedirs(app.config['UPLOAD_SESSION_FOLDER'], exist_ok=True)
+            source_digest = storage.write_stream(video_file.stream, video_path)
+            start_processing(video_id, title, description, video_path, source_digest, request.files.get('thumbnail'))
         except Exception as e:
-            flash(f'An error occurred during upload: {str(e)}', 'danger')
-            print(e)
-            db.session.rollback()
-
-            # Удаление всех созданных файлов в случае ошибки
-            if os.path.exists(video_path):
-                os.remove(video_path)
-            for variant in variants.values():
-                variant_path = os.path.join(app.config['UPLOAD_FOLDER'], variant)
-                if os.path.exists(variant_path):
-                    os.remove(variant_path)
-            if os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
-
-            return redirect(request.url)
+            app.logger.exception('Upload %s failed', video_id)
+            return upload_error(f'An error occurred during upload: {str(e)}')
+
+        if wants_json():
+            return jsonify(success=True, video_id=video_id,
+                           status_url=url_for('video_status', video_id=video_id)), 202
+        flash('Video uploaded successfully, it will appear once processing is finished.')
+        return redirect(url_for('home'))
 
     return render_template('upload.html')
 
 
+def start_processing(video_id, title, description, source_path, source_digest, thumbnail_file=None):
+    """Create the hidden Video for an uploaded source and queue it for transcoding.
+
+    Commits. On failure the source and poster files are removed.
+    """
+    thumbnail_path = None
+    poster_digest = None
+    try:
+        # Optional poster; the worker turns it (or a frame of the video) into the sized thumbnails
+        if thumbnail_file and thumbnail_file.filename:
+            extension = os.path.splitext(secure_filename(thumbnail_file.filename))[1]
+            thumbnail_path = os.path.join(app.config['UPLOAD_SESSION_FOLDER'], f"{video_id}_poster{extension}")
+            poster_digest = storage.write_stream(thumbnail_file.stream, thumbnail_path)
+
+        # The video stays hidden until the worker has produced its renditions
+        video = Video(
+            video_id=video_id,
+            title=title,
+            description=description,
+            user_id=current_user.id,
+            source_digest=source_digest,
+            status=Video.STATUS_PROCESSING
+        )
+        db.session.add(video)
+        enqueue_transcode(video, source_path, thumbnail_path, poster_digest)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+
+        # Удаление всех созданных файлов в случае ошибки
+        for path in (source_path, thumbnail_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise
+    return video
+
+
+def upload_error(message):
+    if wants_json():
+        return jsonify(success=False, message=message), 400
+    flash(message, 'danger')
+    return redirect(request.url)
+
+
+@app.errorhandler(UploadError)
+def handle_upload_error(error):
+    return jsonify(success=False, message=str(error)), error.status
+
+
+def upload_session_or_404(upload_id):
+    return UploadSession.query.filter_by(id=upload_id, user_id=current_user.id).first_or_404()
+
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    data = request.get_json()
+    filename = data.get('filename', '')
+    if not allowed_file(filename):
+        raise UploadError('File type not allowed.')
+    if not isinstance(data.get('size'), int):
+        raise UploadError('File size is required.')
+    session = uploads.create_session(current_user, filename, data['size'], data.get('title', ''),
+                                     data.get('description', ''))
+    return jsonify(success=True, upload_id=session.id, chunk_size=session.chunk_size,
+                   chunk_count=session.chunk_count,
+                   upload_url=url_for('upload_session', upload_id=session.id)), 201
+
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'DELETE'])
+@login_required
+def upload_session(upload_id):
+    session = upload_session_or_404(upload_id)
+    if request.method == 'DELETE':
+        uploads.discard(session)
+        db.session.commit()
+        return jsonify(success=True)
+    return jsonify(upload_id=session.id, size=session.size, chunk_size=session.chunk_size,
+                   chunk_count=session.chunk_count, missing=uploads.missing_chunks(session))
+
+
+# Chunks of one file easily exceed the default request limits
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@limiter.exempt
+@login_required
+def upload_chunk(upload_id, index):
+    session = upload_session_or_404(upload_id)
+    data = request.stream.read(session.chunk_size + 1)
+    uploads.write_chunk(session, index, data, request.headers.get('X-Chunk-SHA256'))
+    return jsonify(success=True, index=index)
+
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    session = upload_session_or_404(upload_id)
+    title, description = session.title, session.description
+    source_path, source_digest = uploads.complete(session)
+    video_id = uuid.uuid4().hex
+    try:
+        start_processing(video_id, title, description, source_path, source_digest, request.files.get('thumbnail'))
+    except Exception as e:
+        # start_processing has removed the source; the session is gone already
+        app.logger.exception('Upload %s failed', video_id)
+        raise UploadError(f'An error occurred during upload: {str(e)}', 500)
+    return jsonify(success=True, video_id=video_id,
+                   status_url=url_for('video_status', video_id=video_id)), 202
+
+
+@app.route('/video/<video_id>/status')
+# Polled by the upload page for as long as the transcode takes
+@limiter.limit("60 per minute")
+def video_status(video_id):
+    video = Video.query.filter_by(video_id=video_id).first_or_404()
+    response = {'video_id': video.video_id, 'status': video.status}
+    if video.is_ready:
+        response['url'] = url_for('view_video', video_id=video.video_id)
+    return jsonify(response)
+
+
 @app.route('/logout')
 @login_required
 def logout():
+    loaders.forget_user(current_user.id)
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('home'))
 
 
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Repopulate the full-text search index from the video and user tables."""
+    search.rebuild()
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute Video.likes and User.subscriber_count from the like and subscription tables."""
+    reconcile_counters()
+
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics_command():
+    """Recompute the channel totals from the video, like and subscription tables."""
+    analytics.rebuild()
+
+
+@app.cli.command('refresh-recommendations')
+def refresh_recommendations_command():
+    """Recompute suggested videos for every video whose list is stale or missing."""
+    print(f'Refreshed {recommendations.refresh_stale()} videos')
+
+
+@app.cli.command('expire-uploads')
+def expire_uploads_command():
+    """Remove resumable upload sessions that have been abandoned."""
+    print(f'Removed {uploads.expire_sessions()} upload sessions')
+
+
+@app.cli.command('evict-renditions')
+def evict_renditions_command():
+    """Delete on-demand renditions past RENDITION_CACHE_BUDGET, least recently played first."""
+    print(f'Evicted {renditions.evict()} renditions')
+
+
+@app.cli.command('benchmark-passwords')
+def benchmark_passwords_command():
+    """Measure logins per second per core for each password hashing setting."""
+    for method, per_second in passwords.benchmark():
+        current = ' (current)' if method == app.config['PASSWORD_HASH_METHOD'] else ''
+        print(f'{method:24} {per_second:8.1f} logins/s per core{current}')
+
+
+@app.cli.command('transcode-worker')
+def transcode_worker_command():
+    """Run the transcoding queue worker in the foreground."""
+    TranscodeWorker(app).run()
+
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+    # With the reloader only the child process serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        TranscodeWorker(app).start()
     app.run(debug=True)
@@ -0,0 +1,375 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Benchmark harness.
+
+    python bench.py seed --rows 100000 --seed 1
+    python bench.py run --requests 500 --output before.json
+    python bench.py compare before.json after.json
+
+`seed` recreates the benchmark database (`DATABASE_URL`, by default
+instance/bench.db) with a synthetic catalogue. `--rows` is split over users
+(1%), videos (9%), likes (60%) and subscriptions (30%), with likes and
+subscriptions skewed towards popular videos and channels. The same seed
+always produces the same catalogue. Videos point at a few stub thumbnails,
+storyboards and playlists so their pages link to files that exist. Search,
+recommendation and analytics tables are filled in as the live app would
+have them.
+
+`run` replays each scenario through the test client after a warm-up and
+reports p50/p95/p99 latency, throughput, SQL statements per request and peak
+RSS as JSON. Every scenario runs in a fresh interpreter, so its peak RSS is
+not inflated by the scenarios before it (it is null where the `resource`
+module is missing, as on Windows). `compare` prints the change per metric
+between two such files.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///bench.db')
+
+from PIL import Image  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy.engine import make_url  # noqa: E402
+
+import analytics  # noqa: E402
+import app as application  # noqa: E402
+import loaders  # noqa: E402
+import recommendations  # noqa: E402
+import search  # noqa: E402
+from media import THUMBNAIL_WIDTHS  # noqa: E402
+from models import db, reconcile_counters, Like, Subscription, User, Video, VideoRendition  # noqa: E402
+from storage import shard_path  # noqa: E402
+
+app = application.app
+
+SHARES = {'users': 0.01, 'videos': 0.09, 'likes': 0.6, 'subscriptions': 0.3}
+STUB_MEDIA = 8
+BATCH_SIZE = 10000
+WORDS = ('обзор', 'музыка', 'игра', 'новости', 'рецепт', 'путешествие', 'кот', 'футбол', 'урок', 'python',
+         'flask', 'стрим', 'влог', 'концерт', 'трейлер', 'лекция', 'горы', 'море', 'гитара', 'ремонт')
+SCENARIOS = ('home', 'home_search', 'view_video', 'view_channel', 'liked_videos', 'like_video', 'update_views')
+PERCENTILES = (50, 95, 99)
+
+
+def _skewed(rng, n):
+    """Index in range(n), small indexes (popular items) much more likely."""
+    return int(n * rng.random() ** 3)
+
+
+def _stub_media():
+    """Write the stub files and return their content-addressed directories."""
+    directories = []
+    for index in range(STUB_MEDIA):
+        directory = shard_path(hashlib.sha256(f'bench-{index}'.encode()).hexdigest())
+        images = os.path.join(app.config['THUMBNAIL_FOLDER'], directory)
+        playlists = os.path.join(app.config['UPLOAD_FOLDER'], directory)
+        os.makedirs(images, exist_ok=True)
+        os.makedirs(playlists, exist_ok=True)
+        color = (index * 30 % 256, 90, 160)
+        for width in THUMBNAIL_WIDTHS:
+            image = Image.new('RGB', (width, width * 9 // 16), color)
+            image.save(os.path.join(images, f'{width}.jpg'), quality=60)
+            image.save(os.path.join(images, f'{width}.webp'), quality=60)
+        Image.new('RGB', (1600, 360), color).save(os.path.join(images, 'storyboard.jpg'), quality=60)
+        with open(os.path.join(images, 'storyboard.vtt'), 'w') as f:
+            f.write('WEBVTT\n')
+        with open(os.path.join(playlists, 'master.m3u8'), 'w') as f:
+            f.write('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360\n360p.m3u8\n')
+        with open(os.path.join(playlists, '360p.m3u8'), 'w') as f:
+            f.write('#EXTM3U\n#EXT-X-ENDLIST\n')
+        directories.append(directory)
+    return directories
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def seed(rows, seed_value):
+    rng = random.Random(seed_value)
+    counts = {table: max(1, int(rows * share)) for table, share in SHARES.items()}
+    users, videos = max(2, counts['users']), counts['videos']
+    now = datetime(2025, 1, 1)
+    directories = _stub_media()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = application.passwords.hash_password('bench')
+        _insert(User, [{
+            'id': index + 1,
+            'username': f'user{index}',
+            'email': f'user{index}@bench.local',
+            'password_hash': password_hash,
+            'channel_name': f'Канал {index}',
+            'channel_description': ' '.join(rng.choices(WORDS, k=6)),
+        } for index in range(users)])
+
+        video_rows, rendition_rows = [], []
+        for index in range(videos):
+            video_id = f'{rng.getrandbits(128):032x}'
+            directory = directories[index % STUB_MEDIA]
+            video_rows.append({
+                'id': index + 1,
+                'video_id': video_id,
+                'title': ' '.join(rng.choices(WORDS, k=4)),
+                'description': ' '.join(rng.choices(WORDS, k=20)),
+                'user_id': _skewed(rng, users) + 1,
+                'created_at': now - timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                'views': int(1000000 * rng.random() ** 4),
+                'duration': f'{rng.randrange(1, 60)}:{rng.randrange(60):02}',
+                'thumbnail_dir': directory,
+                'thumbnail_filename': f'{directory}/640.jpg',
+                'hls_playlist': f'{directory}/master.m3u8',
+                'status': Video.STATUS_READY,
+            })
+            rendition_rows.append({'video_id': video_id, 'quality': '360p', 'width': 640, 'height': 360,
+                                   'codec': 'h264', 'bitrate': 800000, 'path': f'{directory}/360p.m3u8'})
+        _insert(Video, video_rows)
+        _insert(VideoRendition, rendition_rows)
+
+        like_rows = []
+        for user_index in range(users):
+            liked = set()
+            for _ in range(counts['likes'] // users):
+                liked.add(video_rows[_skewed(rng, videos)]['video_id'])
+            like_rows.extend({'user_id': user_index + 1, 'video_id': video_id} for video_id in sorted(liked))
+        _insert(Like, like_rows)
+
+        subscription_rows = []
+        for user_index in range(users):
+            channels = set()
+            for _ in range(min(counts['subscriptions'] // users, users - 1)):
+                channel = _skewed(rng, users)
+                if channel != user_index:
+                    channels.add(channel + 1)
+            subscription_rows.extend({'subscriber_id': user_index + 1, 'subscribed_to_id': channel,
+                                      'created_at': now} for channel in sorted(channels))
+        _insert(Subscription, subscription_rows)
+        db.session.commit()
+
+        reconcile_counters()
+        search.rebuild()
+        recommendations.refresh_stale()
+        analytics.rebuild()
+    return {'users': users, 'videos': videos, 'likes': len(like_rows), 'subscriptions': len(subscription_rows)}
+
+
+class Recorder:
+    """Collects the SQL statement count of every request."""
+
+    def __init__(self):
+        self.query_counts = []
+        self._lock = threading.Lock()
+
+    def after_request(self, response):
+        with self._lock:
+            self.query_counts.append(loaders.query_count())
+        return response
+
+
+def _login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def _targets(limit=200):
+    with app.app_context():
+        video_ids = [row[0] for row in db.session.query(Video.video_id).order_by(Video.views.desc()).limit(limit)]
+        user_ids = [row[0] for row in db.session.query(User.id).order_by(User.subscriber_count.desc()).limit(limit)]
+    return video_ids, user_ids
+
+
+def _request(scenario, client, rng, video_ids, user_ids):
+    if scenario == 'home':
+        return client.get('/')
+    if scenario == 'home_search':
+        return client.get('/', query_string={'query': ' '.join(rng.sample(WORDS, 2))})
+    if scenario == 'view_video':
+        return client.get(f'/video/{rng.choice(video_ids)}')
+    if scenario == 'view_channel':
+        return client.get(f'/channel/{rng.choice(user_ids)}')
+    if scenario == 'liked_videos':
+        return client.get('/liked_videos')
+    if scenario == 'like_video':
+        return client.post(f'/like/{rng.choice(video_ids)}')
+    if scenario == 'update_views':
+        return client.post('/update_views', json={'video_id': rng.choice(video_ids)})
+    raise ValueError(scenario)
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_scenario(scenario, requests, warmup, threads, seed_value, recorder, video_ids, user_ids):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker(worker_index, count, record):
+        rng = random.Random(f'{seed_value}:{scenario}:{worker_index}')
+        client = app.test_client()
+        _login(client, user_ids[worker_index % len(user_ids)])
+        for _ in range(count):
+            started = time.perf_counter()
+            response = _request(scenario, client, rng, video_ids, user_ids)
+            elapsed = time.perf_counter() - started
+            if record:
+                with lock:
+                    latencies.append(elapsed)
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+
+    worker(0, warmup, False)
+    recorder.query_counts.clear()
+    per_thread = [requests // threads + (index < requests % threads) for index in range(threads)]
+    pool = [threading.Thread(target=worker, args=(index, count, True)) for index, count in enumerate(per_thread)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    result = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'queries_mean': round(sum(recorder.query_counts) / max(1, len(recorder.query_counts)), 2),
+        'queries_max': max(recorder.query_counts, default=0),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+    for percent in PERCENTILES:
+        result[f'p{percent}_ms'] = round(_percentile(latencies, percent) * 1000, 3)
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scenario_main(scenario, requests, warmup, threads, seed_value):
+    """Run one scenario in this process, see `run`."""
+    application.limiter.enabled = False
+    # Scenarios log in by writing the session cookie directly
+    app.secret_key = app.secret_key or 'bench'
+    recorder = Recorder()
+    app.after_request(recorder.after_request)
+    video_ids, user_ids = _targets()
+    return run_scenario(scenario, requests, warmup, threads, seed_value, recorder, video_ids, user_ids)
+
+
+def run(scenarios, requests, warmup, threads, seed_value):
+    with app.app_context():
+        catalogue = {'users': User.query.count(), 'videos': Video.query.count(), 'likes': Like.query.count(),
+                     'subscriptions': Subscription.query.count()}
+    results = {}
+    for scenario in scenarios:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), 'scenario', scenario, '--requests', str(requests),
+             '--warmup', str(warmup), '--threads', str(threads), '--seed', str(seed_value)],
+            capture_output=True, text=True, check=True).stdout
+        results[scenario] = json.loads(output.splitlines()[-1])
+    return {
+        'meta': {
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'database': make_url(app.config['SQLALCHEMY_DATABASE_URI']).render_as_string(hide_password=True),
+            'catalogue': catalogue,
+            'requests': requests,
+            'warmup': warmup,
+            'threads': threads,
+            'seed': seed_value,
+            'date': datetime.now().isoformat(timespec='seconds'),
+        },
+        'scenarios': results,
+    }
+
+
+def compare(before, after):
+    for scenario, new in after['scenarios'].items():
+        old = before['scenarios'].get(scenario)
+        if old is None:
+            continue
+        print(scenario)
+        for metric, value in new.items():
+            if isinstance(value, (int, float)) and isinstance(old.get(metric), (int, float)):
+                change = f'{(value - old[metric]) / old[metric] * 100:+.1f}%' if old[metric] else ''
+                print(f'  {metric:16} {old[metric]:>12} -> {value:<12} {change}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Owu benchmark harness')
+    commands = parser.add_subparsers(dest='command', required=True)
+    seed_parser = commands.add_parser('seed', help='recreate the benchmark database')
+    seed_parser.add_argument('--rows', type=int, default=10000)
+    seed_parser.add_argument('--seed', type=int, default=1)
+    run_parser = commands.add_parser('run', help='run the scenarios')
+    run_parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    run_parser.add_argument('--requests', type=int, default=500)
+    run_parser.add_argument('--warmup', type=int, default=50)
+    run_parser.add_argument('--threads', type=int, default=1)
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output')
+    scenario_parser = commands.add_parser('scenario', help='run one scenario in this process')
+    scenario_parser.add_argument('scenario', choices=SCENARIOS)
+    for option, default in (('--requests', 500), ('--warmup', 50), ('--threads', 1), ('--seed', 1)):
+        scenario_parser.add_argument(option, type=int, default=default)
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    args = parser.parse_args(argv)
+
+    if args.command == 'seed':
+        print(json.dumps(seed(args.rows, args.seed)))
+    elif args.command == 'run':
+        output = json.dumps(run(args.scenarios, args.requests, args.warmup, args.threads, args.seed),
+                            indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + '\n')
+        else:
+            print(output)
+    elif args.command == 'scenario':
+        print(json.dumps(scenario_main(args.scenario, args.requests, args.warmup, args.threads, args.seed)))
+    else:
+        with open(args.before) as f, open(args.after) as g:
+            compare(json.load(f), json.load(g))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
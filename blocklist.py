@@ -0,0 +1,126 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""IP blocklist with CIDR ranges.
+
+Networks are kept in a binary prefix trie per address family, so a lookup
+walks at most 32 (IPv4) or 128 (IPv6) bits no matter how many ranges are
+blocked. The list is `BLOCKED_NETWORKS` plus the lines of `BLOCKLIST_FILE`
+(one address or network per line, `#` starts a comment). The file is checked
+for changes at most every `BLOCKLIST_RELOAD_SECONDS`, and a changed file
+replaces the trie in one assignment, so ranges can be added without a
+restart.
+"""
+
+import ipaddress
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BLOCKED = 2  # Index of the "network ends here" flag in a trie node
+
+
+class PrefixTrie:
+
+    def __init__(self):
+        # Node: [child for bit 0, child for bit 1, blocked]
+        self._roots = {4: [None, None, False], 6: [None, None, False]}
+
+    def add(self, network):
+        node = self._roots[network.version]
+        bits = int(network.network_address)
+        for position in range(network.max_prefixlen - 1, network.max_prefixlen - 1 - network.prefixlen, -1):
+            if node[BLOCKED]:
+                return  # Already covered by a shorter prefix
+            bit = (bits >> position) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[BLOCKED] = True
+        node[0] = node[1] = None
+
+    def __contains__(self, address):
+        node = self._roots[address.version]
+        bits = int(address)
+        for position in range(address.max_prefixlen - 1, -1, -1):
+            if node[BLOCKED]:
+                return True
+            node = node[(bits >> position) & 1]
+            if node is None:
+                return False
+        return node[BLOCKED]
+
+
+def parse_networks(lines):
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        try:
+            yield ipaddress.ip_network(line, strict=False)
+        except ValueError:
+            logger.warning('Skipping invalid blocklist entry %r', line)
+
+
+class Blocklist:
+
+    def __init__(self, networks=(), path=None, reload_seconds=5.0):
+        self.networks = list(networks)
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._mtime = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self._trie = self._build([])
+
+    def init_app(self, app):
+        self.networks = list(app.config['BLOCKED_NETWORKS'])
+        self.path = app.config['BLOCKLIST_FILE']
+        self.reload_seconds = app.config['BLOCKLIST_RELOAD_SECONDS']
+        self.reload()
+
+    def _build(self, file_lines):
+        trie = PrefixTrie()
+        for network in parse_networks([*self.networks, *file_lines]):
+            trie.add(network)
+        return trie
+
+    def reload(self):
+        lines = []
+        mtime = None
+        if self.path and os.path.exists(self.path):
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path) as f:
+                lines = f.readlines()
+        self._trie = self._build(lines)
+        self._mtime = mtime
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.reload_seconds
+            try:
+                mtime = os.stat(self.path).st_mtime_ns if self.path else None
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._mtime:
+                self.reload()
+        finally:
+            self._lock.release()
+
+    def is_blocked(self, address):
+        self._reload_if_changed()
+        try:
+            address = ipaddress.ip_address(address)
+        except (TypeError, ValueError):
+            return False
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        return address in self._trie
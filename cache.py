@@ -0,0 +1,158 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Rendered fragment cache with tag-based invalidation.
+
+Fragments (a feed card, a channel header, the suggested videos sidebar) are
+kept in a per-process LRU with a TTL, and so are the snapshots of logged-in
+users. Every entry remembers the version of each tag it depends on, e.g.
+`video:<video_id>`, `channel:<user_id>` or `user:<user_id>`.
+Events bump tag versions in the `cache_tag` table inside their own
+transaction, and every process picks up changed tags at most
+`FRAGMENT_TAG_SYNC_SECONDS` later, so an invalidation reaches all gunicorn
+workers without a shared cache server.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app, render_template
+from markupsafe import Markup
+from sqlalchemy import update
+
+from database import insert_ignore
+from models import db, CacheTag
+
+SYNC_OVERLAP = timedelta(seconds=30)
+
+
+class TagVersions:
+    """Versions of the invalidation tags this process knows about."""
+
+    def __init__(self, sync_seconds=1.0):
+        self.sync_seconds = sync_seconds
+        # Only changes made after this process started matter: entries are
+        # stamped with the versions this process knows, which start at 0
+        self._versions = {}
+        self._synced_at = datetime.now()
+        self._next_sync = 0
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """Pull tag versions changed by any process since the last sync."""
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        synced_at = datetime.now()
+        # Overlap the windows: a bump is stamped before its transaction commits
+        rows = db.session.query(CacheTag.tag, CacheTag.version) \
+            .filter(CacheTag.updated_at >= self._synced_at - SYNC_OVERLAP).all()
+        with self._lock:
+            for tag, version in rows:
+                self._versions[tag] = max(version, self._versions.get(tag, 0))
+            self._synced_at = synced_at
+            self._next_sync = now + self.sync_seconds
+
+    def get(self, tag):
+        return self._versions.get(tag, 0)
+
+    def invalidate(self, *tags):
+        """Bump the version of `tags`. Runs in the caller's transaction; the caller commits."""
+        now = datetime.now()
+        for tag in tags:
+            updated = db.session.execute(update(CacheTag).where(CacheTag.tag == tag)
+                                         .values(version=CacheTag.version + 1, updated_at=now)).rowcount
+            if not updated:
+                if not insert_ignore(db.session, CacheTag, tag=tag, version=1, updated_at=now):
+                    db.session.execute(update(CacheTag).where(CacheTag.tag == tag)
+                                       .values(version=CacheTag.version + 1, updated_at=now))
+            with self._lock:
+                # Invalidate locally right away instead of waiting for the next sync
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+
+class FragmentCache:
+
+    def __init__(self, tag_versions, max_entries=5000, ttl=300):
+        self.tag_versions = tag_versions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        self.tag_versions.sync()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires, tags = entry
+            if expires < time.monotonic() or any(self.tag_versions.get(tag) != version
+                                                 for tag, version in tags.items()):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, tags=(), ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            versions = {tag: self.tag_versions.get(tag) for tag in tags}
+            self._entries[key] = (value, time.monotonic() + ttl, versions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+tag_versions = TagVersions()
+fragment_cache = FragmentCache(tag_versions)
+# Snapshots of logged-in users, see loaders.load_user
+user_cache = FragmentCache(tag_versions)
+# Heads of subscription feeds, see feeds.py
+feed_cache = FragmentCache(tag_versions)
+
+
+def init_app(app):
+    tag_versions.sync_seconds = app.config['FRAGMENT_TAG_SYNC_SECONDS']
+    fragment_cache.max_entries = app.config['FRAGMENT_CACHE_SIZE']
+    fragment_cache.ttl = app.config['FRAGMENT_CACHE_TTL']
+    user_cache.max_entries = app.config['USER_CACHE_SIZE']
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+    feed_cache.max_entries = app.config['FEED_CACHE_SIZE']
+    feed_cache.ttl = app.config['FEED_CACHE_TTL']
+
+
+def invalidate(*tags):
+    tag_versions.invalidate(*tags)
+
+
+def get_fragment(key):
+    if not current_app.config['FRAGMENT_CACHE_ENABLED']:
+        return None
+    return fragment_cache.get(key)
+
+
+def set_fragment(key, html, tags, ttl=None):
+    if current_app.config['FRAGMENT_CACHE_ENABLED']:
+        fragment_cache.set(key, html, tags, ttl)
+
+
+def render_fragment(template, key, tags, ttl=None, **context):
+    """Render `template` with `context`, or return the cached HTML for `key`."""
+    html = get_fragment(key)
+    if html is None:
+        html = Markup(render_template(template, **context))
+        set_fragment(key, html, tags, ttl)
+    return html
@@ -0,0 +1,116 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Engine configuration and read-replica routing.
+
+The database is picked with `DATABASE_URL` (SQLite file by default, or
+PostgreSQL). SQLite connections run in WAL mode so readers no longer block
+the writers of views, likes and the transcode queue, and they enforce
+foreign keys like PostgreSQL does. PostgreSQL gets a bounded, pre-pinged
+connection pool.
+
+When `DATABASE_REPLICA_URL` is set, views decorated with `read_replica`
+send their SELECTs for GET requests to the `replica` bind. Writes, flushes
+and everything outside those views stay on the primary. A replica may lag
+behind, so only pages that can show slightly old data are routed there.
+"""
+
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.elements import TextClause
+
+REPLICA = 'replica'
+
+
+def engine_options(url, config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the database at `url`."""
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        return {}  # See init_app
+    return {
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def configure(app):
+    """Fill the Flask-SQLAlchemy settings from the DATABASE_* ones. Call before db.init_app."""
+    config = app.config
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(config['SQLALCHEMY_DATABASE_URI'], config))
+    replica_url = config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA] = {'url': replica_url,
+                                                              **engine_options(replica_url, config)}
+
+
+def init_app(app):
+    """Apply the SQLite pragmas to every new connection. Call after db.init_app."""
+    pragmas = (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA foreign_keys=ON',
+        f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}",
+    )
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    with app.app_context():
+        for engine in app.extensions['sqlalchemy'].engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', set_pragmas)
+
+
+def insert_ignore(session, model, **values):
+    """INSERT a row unless it conflicts with an existing one. Returns whether it was added.
+
+    Runs in the session's transaction. Used instead of a savepoint around
+    add(): pysqlite opens no transaction for a SAVEPOINT, so its RELEASE
+    would commit the row apart from the statements that follow it.
+    """
+    dialect = postgresql if session.get_bind(mapper=model.__mapper__).dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(model).values(**values).on_conflict_do_nothing()
+    return session.execute(statement).rowcount == 1
+
+
+def read_replica(view):
+    """Serve the SELECTs of GET requests to this view from the replica, if there is one."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method == 'GET':
+            g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _is_read(clause):
+    if isinstance(clause, Select):
+        return True
+    return isinstance(clause, TextClause) and clause.text.lstrip()[:6].upper() == 'SELECT'
+
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context() and g.get('use_replica')
+                and _is_read(clause)):
+            engine = self._db.engines.get(REPLICA)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
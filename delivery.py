@@ -0,0 +1,191 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Byte-range aware delivery of uploaded media files.
+
+Every file gets a strong ETag. Only segments and images of renditions that
+stay on disk for good are sent as immutable for a year: playlists, and the
+files of rungs encoded on demand (evicted and encoded again, under the same
+names, when played later) are cached briefly and then revalidated. Bodies go
+through the server's `wsgi.file_wrapper` where possible so gunicorn/uWSGI can
+hand them to `sendfile` without copying them through Python.
+"""
+
+import mimetypes
+import os
+import uuid
+from email.utils import formatdate
+
+from flask import Response, abort, request
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+CHUNK_SIZE = 256 * 1024
+# Beyond this many ranges a client is more likely probing than seeking
+MAX_RANGES = 16
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=30, must-revalidate'
+IMMUTABLE_EXTENSIONS = frozenset({'.m4s', '.ts', '.mp4', '.m4a', '.jpg', '.jpeg', '.png', '.webp', '.vtt'})
+
+
+def parse_byte_ranges(header, size):
+    """Parse a `Range` header into sorted, merged `(start, stop)` pairs.
+
+    `stop` is exclusive. Returns None when the header is absent, malformed
+    or asks for too many ranges (the whole file is sent), and an empty list
+    when no range overlaps the file (416).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        first, dash, last = part.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, stop = max(0, size - length), size
+            else:
+                start = int(first)
+                stop = int(last) + 1 if last else size
+                if last and stop <= start:
+                    return None
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(stop, size)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _if_range_matches(etag, mtime):
+    header = request.if_range
+    if header.etag is not None:
+        # If-Range only accepts strong validators
+        return not header.etag.startswith('W/') and header.etag.strip('"') == etag
+    if header.date is not None:
+        return int(mtime) <= header.date.timestamp()
+    return True
+
+
+def _read_range(file, start, length):
+    file.seek(start)
+    while length > 0:
+        chunk = file.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+
+def _multipart_body(file, ranges, size, content_type, boundary):
+    try:
+        for start, stop in ranges:
+            yield (f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+                   f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode('latin-1')
+            yield from _read_range(file, start, stop - start)
+        yield f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    finally:
+        file.close()
+
+
+def _single_range_body(file, start, length):
+    try:
+        yield from _read_range(file, start, length)
+    finally:
+        file.close()
+
+
+def cache_control(filename, materialized):
+    if materialized and os.path.splitext(filename)[1].lower() in IMMUTABLE_EXTENSIONS:
+        return IMMUTABLE_CACHE_CONTROL
+    return REVALIDATE_CACHE_CONTROL
+
+
+def send_media(directory, filename, materialized=False):
+    """Send `filename`, as immutable if it is a segment or image and `materialized` (never re-encoded)."""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f'{stat.st_ino:x}-{size:x}-{stat.st_mtime_ns:x}'
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': cache_control(filename, materialized),
+        'ETag': f'"{etag}"',
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+    }
+
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+    elif request.if_modified_since:
+        if int(stat.st_mtime) <= request.if_modified_since.timestamp():
+            return Response(status=304, headers=headers)
+
+    ranges = parse_byte_ranges(request.headers.get('Range'), size)
+    if ranges is not None and 'If-Range' in request.headers and not _if_range_matches(etag, stat.st_mtime):
+        ranges = None
+
+    if ranges == []:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    # HEAD gets the headers GET would, without opening the file
+    head = request.method == 'HEAD'
+
+    if not ranges or ranges == [(0, size)]:
+        headers['Content-Length'] = str(size)
+        if head:
+            return Response(status=200, headers=headers, content_type=content_type)
+        body = wrap_file(request.environ, open(path, 'rb'), CHUNK_SIZE)
+        return Response(body, status=200, headers=headers, content_type=content_type, direct_passthrough=True)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        if head:
+            return Response(status=206, headers=headers, content_type=content_type)
+        file = open(path, 'rb')
+        if 'wsgi.file_wrapper' in request.environ:
+            # gunicorn sends `Content-Length` bytes from the current offset via sendfile
+            file.seek(start)
+            body = request.environ['wsgi.file_wrapper'](file, CHUNK_SIZE)
+        else:
+            body = _single_range_body(file, start, stop - start)
+        return Response(body, status=206, headers=headers, content_type=content_type, direct_passthrough=True)
+
+    boundary = uuid.uuid4().hex
+    headers['Content-Length'] = str(sum(
+        len(f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n') + stop - start
+        for start, stop in ranges) + len(f'\r\n--{boundary}--\r\n'))
+    mimetype = f'multipart/byteranges; boundary={boundary}'
+    if head:
+        return Response(status=206, headers=headers, mimetype=mimetype)
+    body = _multipart_body(open(path, 'rb'), ranges, size, content_type, boundary)
+    return Response(body, status=206, headers=headers, mimetype=mimetype, direct_passthrough=True)
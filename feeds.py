@@ -0,0 +1,79 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Subscriptions feed: the latest uploads of the channels a user follows.
+
+A page is the newest ready videos of the followed channels before a
+`(created_at, id)` keyset cursor. The channels are split into chunks of
+`FEED_CHANNEL_CHUNK`; each chunk is one `user_id IN (...)` query that seeks
+`ix_video_user_id_created_at` from the cursor with a LIMIT of one page, and
+the chunks' sorted results are k-way merged with a heap. Following
+thousands of channels thus means a few queries per page rather than
+thousands.
+
+The first `FEED_HEAD_SIZE` entries of every user's timeline (timestamps and
+ids only) are cached per process under the `uploads:<channel>` tags of the
+followed channels and the user's `subscriptions:<user>` tag, so an upload or
+a (un)subscribe rebuilds it, and the first pages only load their videos.
+"""
+
+import heapq
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+
+import cache
+from models import db, Subscription, Video
+
+
+def followed_channels(user_id):
+    return db.session.scalars(db.select(Subscription.subscribed_to_id)
+                              .where(Subscription.subscriber_id == user_id)).all()
+
+
+def timeline(channel_ids, before=None, limit=None):
+    """`(created_at, id)` of the newest `limit` ready videos of the channels older than `before`, newest first."""
+    chunk = current_app.config['FEED_CHANNEL_CHUNK']
+    streams = []
+    for start in range(0, len(channel_ids), chunk):
+        query = db.session.query(Video.created_at, Video.id).filter(
+            Video.user_id.in_(channel_ids[start:start + chunk]),
+            Video.status == Video.STATUS_READY,
+        )
+        if before is not None:
+            created_at, video_id = before
+            query = query.filter(or_(Video.created_at < created_at,
+                                     and_(Video.created_at == created_at, Video.id < video_id)))
+        rows = query.order_by(Video.created_at.desc(), Video.id.desc()).limit(limit).all()
+        streams.append([tuple(row) for row in rows])
+    return list(islice(heapq.merge(*streams, reverse=True), limit))
+
+
+def _head(user_id):
+    """The user's followed channels and the start of their timeline, from the cache if possible."""
+    key = f'subscriptions:{user_id}'
+    head = cache.feed_cache.get(key)
+    if head is None:
+        channels = followed_channels(user_id)
+        head = (channels, timeline(channels, limit=current_app.config['FEED_HEAD_SIZE']))
+        cache.feed_cache.set(key, head, [key, *(f'uploads:{channel}' for channel in channels)])
+    return head
+
+
+def page(user_id, before=None, page_size=None):
+    """One page of the user's subscriptions feed. Returns `(videos, has_more)`."""
+    page_size = page_size or current_app.config['FEED_PAGE_SIZE']
+    channels, head = _head(user_id)
+    entries = head if before is None else [entry for entry in head if entry < before]
+    if len(entries) <= page_size and len(head) >= current_app.config['FEED_HEAD_SIZE']:
+        # Past the cached head, which does not hold the whole timeline
+        entries = timeline(channels, before, page_size + 1)
+    entries = entries[:page_size + 1]
+    ids = [video_id for _, video_id in entries[:page_size]]
+    videos = {video.id: video for video in
+              Video.query.filter(Video.id.in_(ids)).options(joinedload(Video.user))} if ids else {}
+    return [videos[video_id] for video_id in ids if video_id in videos], len(entries) > page_size
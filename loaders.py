@@ -0,0 +1,109 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Per-request batch loaders and SQL query accounting.
+
+Templates ask "is the viewer subscribed to this channel / has the viewer
+liked this video" once per card. `Viewer` answers from two id sets that are
+fetched with one query each the first time they are needed in a request.
+
+`load_user` serves the logged-in user from a snapshot of their profile
+columns in `cache.user_cache`, so authenticated requests do not select the
+user row. Code that changes those columns invalidates `user:<id>`.
+"""
+
+import time
+
+from flask import g, has_request_context
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import make_transient_to_detached
+
+import cache
+from models import db, Like, Subscription, User
+
+# Counters and the password hash are left out and load on first access
+USER_SNAPSHOT_COLUMNS = ('id', 'username', 'email', 'channel_name', 'channel_description', 'avatar_filename')
+
+
+class Viewer:
+
+    def __init__(self, user):
+        self.user = user
+        self._subscribed_ids = None
+        self._liked_video_ids = None
+
+    @property
+    def subscribed_ids(self):
+        if self._subscribed_ids is None:
+            self._subscribed_ids = set()
+            if self.user.is_authenticated:
+                rows = db.session.query(Subscription.subscribed_to_id).filter_by(subscriber_id=self.user.id)
+                self._subscribed_ids = {row[0] for row in rows}
+        return self._subscribed_ids
+
+    @property
+    def liked_video_ids(self):
+        if self._liked_video_ids is None:
+            self._liked_video_ids = set()
+            if self.user.is_authenticated:
+                rows = db.session.query(Like.video_id).filter_by(user_id=self.user.id)
+                self._liked_video_ids = {row[0] for row in rows}
+        return self._liked_video_ids
+
+    def is_subscribed(self, user):
+        return user.id in self.subscribed_ids
+
+    def has_liked(self, video):
+        return video.video_id in self.liked_video_ids
+
+
+def load_user(user_id):
+    key = f'user:{user_id}'
+    snapshot = cache.user_cache.get(key)
+    if snapshot is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            cache.user_cache.set(key, {column: getattr(user, column) for column in USER_SNAPSHOT_COLUMNS},
+                                 tags=(key,))
+        return user
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def forget_user(user_id):
+    cache.user_cache.discard(f'user:{user_id}')
+
+
+def get_viewer():
+    if 'viewer' not in g:
+        g.viewer = Viewer(current_user)
+    return g.viewer
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is not None and has_request_context():
+        g.query_time = g.get('query_time', 0.0) + time.perf_counter() - started
+
+
+def query_count():
+    """Number of SQL statements executed so far in the current request."""
+    return g.get('query_count', 0)
+
+
+def query_time():
+    """Seconds spent executing SQL statements so far in the current request."""
+    return g.get('query_time', 0.0)
@@ -0,0 +1,567 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""ffmpeg/ffprobe helpers used by the transcoding pipeline.
+
+Nothing in here touches Flask or the database, so the functions can be run
+inside worker processes of the transcoding pool.
+"""
+
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import time
+
+import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', r"C:\ffmpeg\bin\ffmpeg.exe")
+FFPROBE_PATH = os.environ.get('FFPROBE_PATH', r"C:\ffmpeg\bin\ffprobe.exe")
+
+# Target frame sizes, largest first
+QUALITIES = {
+    '4K': (3840, 2160),
+    'QHD': (2560, 1440),
+    '1080p': (1920, 1080),
+    '720p': (1280, 720),
+    '480p': (854, 480),
+    '360p': (640, 360),
+}
+
+# Encoder settings per rendition. Large renditions get a faster preset so a
+# 4K upload doesn't spend most of its time in the top rendition.
+DEFAULT_PRESETS = {
+    '4K': {'preset': 'faster', 'crf': '23', 'maxrate': '16M', 'bufsize': '32M'},
+    'QHD': {'preset': 'fast', 'crf': '23', 'maxrate': '10M', 'bufsize': '20M'},
+    '1080p': {'preset': 'medium', 'crf': '23', 'maxrate': '6M', 'bufsize': '12M'},
+    '720p': {'preset': 'medium', 'crf': '23', 'maxrate': '3M', 'bufsize': '6M'},
+    '480p': {'preset': 'medium', 'crf': '24', 'maxrate': '1500k', 'bufsize': '3M'},
+    '360p': {'preset': 'medium', 'crf': '25', 'maxrate': '800k', 'bufsize': '1600k'},
+}
+
+# Poster widths for srcset; every width is written as WebP and as JPEG
+THUMBNAIL_WIDTHS = (320, 640, 1280)
+# The JPEG used for plain <img src> and the JSON feed
+THUMBNAIL_FALLBACK_WIDTH = 640
+
+# Seek preview sprite: one tile every STORYBOARD_MIN_INTERVAL seconds, spread
+# out further for long videos so a sheet never has more than STORYBOARD_MAX_TILES
+STORYBOARD_TILE = (160, 90)
+STORYBOARD_COLUMNS = 10
+STORYBOARD_MAX_TILES = 100
+STORYBOARD_MIN_INTERVAL = 2
+
+# Source kept next to the renditions of a video transcoded on demand
+MEZZANINE_NAME = 'mezzanine'
+
+# "bench: <user> user <sys> sys <real> real <task> <file>.<stream>" lines
+# printed by ffmpeg with -benchmark_all, all times in microseconds
+BENCH_LINE = re.compile(r'bench:\s*(\d+) user\s*(\d+) sys\s*(\d+) real \S*?\s*encode_video \d+\.(\d+)')
+
+
+def run(command, stage):
+    """Run ffmpeg or ffprobe, recording how long it took and how it exited."""
+    started = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, encoding='utf-8', errors='replace')
+    program = os.path.splitext(os.path.basename(command[0]))[0]
+    metrics.record_subprocess(program, stage, result.returncode, time.perf_counter() - started)
+    return result
+
+
+def _vtt_timestamp(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours):02}:{int(minutes):02}:{seconds:06.3f}"
+
+
+def write_storyboard_vtt(vtt_path, sprite_name, duration, interval, columns):
+    """WebVTT index of the sprite: one cue per tile, pointing at it with a #xywh fragment."""
+    tile_width, tile_height = STORYBOARD_TILE
+    lines = ['WEBVTT', '']
+    for index in range(math.ceil(duration / interval)):
+        start, end = index * interval, min((index + 1) * interval, duration)
+        x, y = index % columns * tile_width, index // columns * tile_height
+        lines += [f'{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}',
+                  f'{sprite_name}#xywh={x},{y},{tile_width},{tile_height}', '']
+    with open(vtt_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+def generate_images(video_path, output_dir, duration, poster_path=None):
+    """Write the posters and the storyboard of a video in one ffmpeg pass.
+
+    Posters are taken from the frame at 1s, or from `poster_path` when the
+    uploader supplied an image, and scaled to every THUMBNAIL_WIDTHS width as
+    `<width>.webp` and `<width>.jpg`. All tiles of the storyboard go into a
+    single `storyboard.jpg`, indexed by `storyboard.vtt`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    interval = max(STORYBOARD_MIN_INTERVAL, math.ceil(duration / STORYBOARD_MAX_TILES))
+    tiles = max(1, math.ceil(duration / interval))
+    columns = min(STORYBOARD_COLUMNS, tiles)
+    rows = math.ceil(tiles / columns)
+    tile_width, tile_height = STORYBOARD_TILE
+
+    if poster_path:
+        graph = [f'[1:v]split={len(THUMBNAIL_WIDTHS)}' + ''.join(f'[p{i}]' for i in range(len(THUMBNAIL_WIDTHS))),
+                 '[0:v]null[frames]']
+    else:
+        graph = ['[0:v]split=2[poster][frames]',
+                 f'[poster]trim=start={min(1, duration / 2)},setpts=PTS-STARTPTS,split={len(THUMBNAIL_WIDTHS)}'
+                 + ''.join(f'[p{i}]' for i in range(len(THUMBNAIL_WIDTHS)))]
+    for index, width in enumerate(THUMBNAIL_WIDTHS):
+        graph.append(f'[p{index}]scale={width}:-2,split=2[webp{index}][jpg{index}]')
+    graph.append(f'[frames]fps=1/{interval},'
+                 f'scale={tile_width}:{tile_height}:force_original_aspect_ratio=decrease,'
+                 f'pad={tile_width}:{tile_height}:(ow-iw)/2:(oh-ih)/2,tile={columns}x{rows}[storyboard]')
+
+    command = [FFMPEG_PATH, '-y', '-i', video_path]
+    if poster_path:
+        command += ['-i', poster_path]
+    command += ['-filter_complex', ';'.join(graph)]
+    for index, width in enumerate(THUMBNAIL_WIDTHS):
+        command += [
+            '-map', f'[webp{index}]', '-frames:v', '1', '-c:v', 'libwebp', '-quality', '80',
+            os.path.join(output_dir, f'{width}.webp'),
+            '-map', f'[jpg{index}]', '-frames:v', '1', '-q:v', '3',
+            os.path.join(output_dir, f'{width}.jpg'),
+        ]
+    command += ['-map', '[storyboard]', '-frames:v', '1', '-q:v', '5',
+                os.path.join(output_dir, 'storyboard.jpg')]
+
+    result = run(command, 'images')
+    if result.returncode != 0:
+        raise RuntimeError(f'ffmpeg exited with {result.returncode}: {result.stderr[-500:]}')
+    write_storyboard_vtt(os.path.join(output_dir, 'storyboard.vtt'), 'storyboard.jpg', duration, interval, columns)
+
+
+def _rate(value):
+    """ffprobe rationals like '30000/1001'."""
+    try:
+        numerator, _, denominator = value.partition('/')
+        return float(numerator) / float(denominator or 1)
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rotation(stream):
+    rotation = _int(stream.get('tags', {}).get('rotate'))
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            rotation = _int(side_data['rotation'])
+    return (rotation or 0) % 360
+
+
+def probe(video_path):
+    """Read container, video and audio metadata with a single ffprobe call.
+
+    Only the headers are read. Keys match the MediaInfo columns; width and
+    height are the displayed size, i.e. already swapped for rotated video.
+    """
+    command = [
+        FFPROBE_PATH,
+        '-v', 'error',
+        '-show_format', '-show_streams',
+        '-of', 'json',
+        video_path
+    ]
+    result = run(command, 'probe')
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+    data = json.loads(result.stdout)
+    streams = data.get('streams', [])
+    video = next(stream for stream in streams if stream.get('codec_type') == 'video')
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), {})
+    container = data.get('format', {})
+
+    rotation = _rotation(video)
+    width, height = video['width'], video['height']
+    if rotation in (90, 270):
+        width, height = height, width
+    return {
+        'duration': float(container.get('duration') or video.get('duration') or 0),
+        'container': container.get('format_name'),
+        'bitrate': _int(container.get('bit_rate')),
+        'video_codec': video.get('codec_name'),
+        'pixel_format': video.get('pix_fmt'),
+        'width': width,
+        'height': height,
+        'fps': _rate(video.get('avg_frame_rate')) or _rate(video.get('r_frame_rate')),
+        'video_bitrate': _int(video.get('bit_rate')),
+        'rotation': rotation,
+        'audio_codec': audio.get('codec_name'),
+        'audio_channels': _int(audio.get('channels')),
+        'audio_layout': audio.get('channel_layout'),
+        'audio_sample_rate': _int(audio.get('sample_rate')),
+        'audio_bitrate': _int(audio.get('bit_rate')),
+    }
+
+
+def _bits(rate):
+    """'6M' / '1500k' -> bits per second."""
+    multiplier = {'k': 1e3, 'M': 1e6}.get(rate[-1], 1)
+    return float(rate.rstrip('kM')) * multiplier
+
+
+def can_remux(info, size, preset):
+    """Whether the source video stream can be copied as is into a rendition of this size."""
+    bitrate = info['video_bitrate'] or info['bitrate']
+    return (
+        info['video_codec'] == 'h264'
+        and info['pixel_format'] == 'yuv420p'
+        and info['rotation'] == 0
+        and (info['width'], info['height']) == size
+        and bitrate is not None and bitrate <= _bits(preset['maxrate'])
+    )
+
+
+def _scale_filter(src_width, src_height, target_width, target_height):
+    """Fit the source into the target frame, padding to keep the aspect ratio."""
+    aspect_ratio = src_width / src_height
+    target_ratio = target_width / target_height
+    if abs(aspect_ratio - target_ratio) < 0.01:
+        # Standard aspect ratio, just scale
+        return f'scale={target_width}:{target_height}'
+    if aspect_ratio > target_ratio:
+        width, height = target_width, int(target_width / aspect_ratio) // 2 * 2
+    else:
+        width, height = int(target_height * aspect_ratio) // 2 * 2, target_height
+    return f'scale={width}:{height},pad={target_width}:{target_height}:(ow-iw)/2:(oh-ih)/2'
+
+
+def rendition_ladder(width, height):
+    """Renditions to produce for a source of this size, as {quality: (width, height)}, largest first.
+
+    Sources smaller than the smallest rung get a single rendition at their own size.
+    """
+    ladder = {quality: size for quality, size in QUALITIES.items() if width >= size[0] or height >= size[1]}
+    if not ladder:
+        width, height = width // 2 * 2, height // 2 * 2
+        ladder = {f'{height}p': (width, height)}
+    return ladder
+
+
+def default_rung(ladder, preferred):
+    """The rung encoded at upload in on-demand mode: `preferred` or the largest one below it."""
+    height = QUALITIES[preferred][1]
+    return next((quality for quality, size in ladder.items() if size[1] <= height), list(ladder)[-1])
+
+
+def _ladder_presets(ladder, presets):
+    smallest = list(QUALITIES)[-1]
+    return {quality: {**DEFAULT_PRESETS.get(quality, DEFAULT_PRESETS[smallest]), **(presets or {}).get(quality, {})}
+            for quality in ladder}
+
+
+def _advertised_bitrate(info, size, preset):
+    if can_remux(info, size, preset):
+        return info['video_bitrate'] or info['bitrate']
+    return int(_bits(preset['maxrate']))
+
+
+def rendition_files(output_dir, quality):
+    """Playlist, init segment and media segments of one rendition."""
+    return [name for name in os.listdir(output_dir) if name.startswith(f'{quality}_') or name == f'{quality}.m3u8']
+
+
+def remove_rendition(output_dir, quality):
+    """Delete one rendition, playlist first so it is never served without its segments."""
+    playlist = os.path.join(output_dir, f'{quality}.m3u8')
+    if os.path.exists(playlist):
+        os.remove(playlist)
+    if os.path.isdir(output_dir):
+        for name in rendition_files(output_dir, quality):
+            os.remove(os.path.join(output_dir, name))
+
+
+def _thread_shares(ladder, threads):
+    """Split the job's thread budget between encoders by output pixel count."""
+    if not threads:
+        return {quality: 0 for quality in ladder}
+    pixels = {quality: width * height for quality, (width, height) in ladder.items()}
+    total = sum(pixels.values())
+    return {quality: max(1, round(threads * count / total)) for quality, count in pixels.items()}
+
+
+def _children_cpu_time():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def generate_video_variants(video_path, info, upload_folder, base_filename, threads=0, presets=None,
+                            segment_seconds=6, qualities=None):
+    """Package every rendition the source is large enough for as one HLS ladder.
+
+    The source is decoded once and fanned out with a split filter, each branch
+    scaled and encoded to its own fMP4-segmented HLS stream. Everything lands
+    in `<upload_folder>/<base_filename>/`: `master.m3u8`, `<quality>.m3u8`
+    playlists and their segments. Keyframes are forced on segment boundaries
+    so players can switch renditions between any two segments.
+
+    A rendition the source already matches (H.264 at that exact size and
+    within its bitrate cap) is remuxed instead of re-encoded, as is AAC
+    audio. A remuxed rendition keeps the source's keyframes, so its segment
+    boundaries can differ from the encoded ones.
+
+    `info` is the result of probe(). `threads` is the thread budget for the
+    whole job (0 lets ffmpeg decide). Returns `(master, renditions, stats)`:
+    the master playlist path relative to `upload_folder`, one dict per
+    rendition (quality, size, codec, bitrate, bytes on disk, playlist path)
+    and wall and CPU seconds for the job and per rendition.
+
+    With `qualities` only those rungs are encoded and no master playlist is
+    written (the returned master is None).
+    """
+    original_width, original_height = info['width'], info['height']
+    ladder = rendition_ladder(original_width, original_height)
+    if qualities is not None:
+        ladder = {quality: size for quality, size in ladder.items() if quality in qualities}
+    presets = _ladder_presets(ladder, presets)
+    write_master = qualities is None
+    qualities = list(ladder)
+    audio = info['audio_codec'] is not None
+    remuxed = {quality for quality in qualities if can_remux(info, ladder[quality], presets[quality])}
+    encoded = {quality: size for quality, size in ladder.items() if quality not in remuxed}
+
+    command = [FFMPEG_PATH, '-y', '-benchmark_all']
+    if threads:
+        command += ['-threads', str(threads), '-filter_complex_threads', str(threads)]
+    command += ['-i', video_path]
+    if encoded:
+        branches = ''.join(f'[s{quality}]' for quality in encoded)
+        graph = [f'[0:v]split={len(encoded)}{branches}']
+        for quality in encoded:
+            graph.append(f'[s{quality}]{_scale_filter(original_width, original_height, *encoded[quality])}[v{quality}]')
+        command += ['-filter_complex', ';'.join(graph)]
+
+    # Video streams come first so output stream N is the video of rendition N
+    for quality in qualities:
+        command += ['-map', '0:v:0' if quality in remuxed else f'[v{quality}]']
+    if audio:
+        for index in range(len(qualities)):
+            command += ['-map', '0:a:0']
+
+    command += [
+        '-c:v', 'libx264',
+        '-sc_threshold', '0',
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})',
+    ]
+    if info['audio_codec'] == 'aac':
+        command += ['-c:a', 'copy']
+    else:
+        command += ['-c:a', 'aac', '-b:a', '128k']
+    shares = _thread_shares(encoded, threads)
+    stream_map = []
+    for index, quality in enumerate(qualities):
+        stream_map.append(f'v:{index},a:{index},name:{quality}' if audio else f'v:{index},name:{quality}')
+        if quality in remuxed:
+            command += [f'-c:v:{index}', 'copy']
+            continue
+        preset = presets[quality]
+        command += [
+            f'-crf:v:{index}', preset['crf'],
+            f'-preset:v:{index}', preset['preset'],
+            # Capped CRF keeps each rung's peak under its advertised BANDWIDTH
+            f'-maxrate:v:{index}', preset['maxrate'],
+            f'-bufsize:v:{index}', preset['bufsize'],
+        ]
+        if shares[quality]:
+            command += [f'-threads:v:{index}', str(shares[quality])]
+
+    output_dir = os.path.join(upload_folder, base_filename)
+    os.makedirs(output_dir, exist_ok=True)
+    command += [
+        '-f', 'hls',
+        '-hls_time', str(segment_seconds),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_type', 'fmp4',
+        '-hls_flags', 'independent_segments',
+        '-hls_fmp4_init_filename', '%v_init.mp4',
+        '-hls_segment_filename', os.path.join(output_dir, '%v_%05d.m4s'),
+    ]
+    if write_master:
+        command += ['-master_pl_name', 'master.m3u8']
+    command += [
+        '-var_stream_map', ' '.join(stream_map),
+        os.path.join(output_dir, '%v.m3u8'),
+    ]
+
+    cpu_before = _children_cpu_time()
+    started = time.perf_counter()
+    result = run(command, 'renditions')
+    wall_time = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f'ffmpeg exited with {result.returncode}: {result.stderr[-500:]}')
+    cpu_time = _children_cpu_time() - cpu_before if cpu_before is not None else None
+
+    renditions = []
+    for quality, (width, height) in ladder.items():
+        renditions.append({
+            'quality': quality,
+            'width': width,
+            'height': height,
+            'codec': 'h264',
+            'bitrate': _advertised_bitrate(info, (width, height), presets[quality]),
+            'size': sum(os.path.getsize(os.path.join(output_dir, name))
+                        for name in rendition_files(output_dir, quality)),
+            'path': f"{base_filename}/{quality}.m3u8",
+        })
+    stats = _rendition_stats(ladder, remuxed, result.stderr, wall_time, cpu_time)
+    return f"{base_filename}/master.m3u8" if write_master else None, renditions, stats
+
+
+def write_master_playlist(info, output_dir, presets=None, first=None):
+    """Write `master.m3u8` for the whole ladder, whether or not its playlists exist yet.
+
+    `first` is listed first, which is where players that don't measure
+    bandwidth start. Returns one dict per rung like generate_video_variants,
+    without size and path.
+    """
+    ladder = rendition_ladder(info['width'], info['height'])
+    presets = _ladder_presets(ladder, presets)
+    renditions = [{'quality': quality, 'width': width, 'height': height, 'codec': 'h264',
+                   'bitrate': _advertised_bitrate(info, (width, height), presets[quality]), 'size': None}
+                  for quality, (width, height) in ladder.items()]
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for rendition in sorted(renditions, key=lambda rendition: rendition['quality'] != first):
+        lines += [f"#EXT-X-STREAM-INF:BANDWIDTH={rendition['bitrate']},"
+                  f"RESOLUTION={rendition['width']}x{rendition['height']}",
+                  f"{rendition['quality']}.m3u8"]
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'master.m3u8'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return renditions
+
+
+def encode_rendition(upload_folder, base_filename, quality, threads=0, presets=None, segment_seconds=6):
+    """Encode one missing rung of an on-demand video from its mezzanine.
+
+    Called in a worker process. The rung is written to a staging directory
+    and moved next to the others with its playlist last, so a player never
+    gets a playlist whose segments are still being written. Returns
+    `{'rendition': ..., 'stats': ...}` like generate_video_variants.
+    """
+    output_dir = os.path.join(upload_folder, base_filename)
+    staging = f'{base_filename}/.{quality}.part'
+    staging_dir = os.path.join(upload_folder, staging)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    try:
+        mezzanine = os.path.join(output_dir, MEZZANINE_NAME)
+        _, renditions, stats = generate_video_variants(mezzanine, probe(mezzanine), upload_folder, staging,
+                                                       threads, presets, segment_seconds, qualities=[quality])
+        if not renditions:
+            raise ValueError(f'{quality} is not part of the ladder of {base_filename}')
+        files = sorted(rendition_files(staging_dir, quality), key=lambda name: name.endswith('.m3u8'))
+        for name in files:
+            os.replace(os.path.join(staging_dir, name), os.path.join(output_dir, name))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    rendition = renditions[0]
+    rendition['path'] = f'{base_filename}/{quality}.m3u8'
+    return {'rendition': rendition, 'stats': stats}
+
+
+def _rendition_stats(ladder, remuxed, stderr, wall_time, cpu_time):
+    qualities = list(ladder)
+    per_output = {}
+    for user, system, real, stream in BENCH_LINE.findall(stderr):
+        totals = per_output.setdefault(int(stream), [0, 0])
+        totals[0] += int(real)
+        totals[1] += int(user) + int(system)
+
+    encoded = [quality for quality in qualities if quality not in remuxed]
+    renditions = {quality: {'wall_time': 0.0, 'cpu_time': 0.0, 'estimated': False, 'remuxed': True}
+                  for quality in remuxed}
+    if per_output:
+        for index, quality in enumerate(qualities):
+            if quality in encoded:
+                real, cpu = per_output.get(index, (0, 0))
+                renditions[quality] = {'wall_time': real / 1e6, 'cpu_time': cpu / 1e6, 'estimated': False,
+                                       'remuxed': False}
+    elif encoded:
+        # ffmpeg builds without per-task benchmarks: attribute by output pixel count
+        pixels = {quality: ladder[quality][0] * ladder[quality][1] for quality in encoded}
+        total = sum(pixels.values())
+        for quality, count in pixels.items():
+            renditions[quality] = {
+                'wall_time': wall_time * count / total,
+                'cpu_time': cpu_time * count / total if cpu_time is not None else None,
+                'estimated': True,
+                'remuxed': False,
+            }
+
+    return {'wall_time': wall_time, 'cpu_time': cpu_time, 'renditions': renditions}
+
+
+def format_duration(duration_seconds):
+    """Returns the duration in 'MM:SS' format, or 'HH:MM:SS' if longer than an hour."""
+    # Calculate hours, minutes, and seconds
+    hours, remainder = divmod(int(duration_seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    else:
+        return f"{minutes}:{seconds:02}"
+
+
+def process_upload(video_path, upload_folder, base_filename, thumbnail_folder, thumbnail_dir, poster_path=None,
+                   threads=0, presets=None, segment_seconds=6, transcode=True, default_quality=None):
+    """Run the whole ffmpeg pipeline for one uploaded source file.
+
+    Called in a worker process. Returns a plain dict so the result can be
+    pickled back to the dispatcher, which owns the database session.
+    Renditions go to `<upload_folder>/<base_filename>/` and images to
+    `<thumbnail_folder>/<thumbnail_dir>/`. With `transcode=False` only the
+    images are made, for a source whose renditions already exist.
+    With `default_quality` only that rung (see default_rung) is encoded, the
+    master playlist lists the whole ladder and the source is moved into the
+    renditions directory as the mezzanine the other rungs are encoded from
+    later.
+    Partially written output is removed if any step fails.
+    """
+    output_dir = os.path.join(upload_folder, base_filename)
+    image_dir = os.path.join(thumbnail_folder, thumbnail_dir)
+    master, renditions, stats = None, [], None
+    try:
+        info = probe(video_path)
+        if transcode and default_quality:
+            first = default_rung(rendition_ladder(info['width'], info['height']), default_quality)
+            _, encoded, stats = generate_video_variants(video_path, info, upload_folder, base_filename,
+                                                        threads, presets, segment_seconds, qualities=[first])
+            renditions = [encoded[0] if rendition['quality'] == first
+                          else {**rendition, 'path': f"{base_filename}/{rendition['quality']}.m3u8"}
+                          for rendition in write_master_playlist(info, output_dir, presets, first)]
+            master = f"{base_filename}/master.m3u8"
+        elif transcode:
+            master, renditions, stats = generate_video_variants(video_path, info, upload_folder, base_filename,
+                                                                threads, presets, segment_seconds)
+        generate_images(video_path, image_dir, info['duration'], poster_path)
+        if transcode and default_quality:
+            shutil.move(video_path, os.path.join(output_dir, MEZZANINE_NAME))
+    except Exception:
+        if transcode:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        shutil.rmtree(image_dir, ignore_errors=True)
+        raise
+
+    return {'duration': format_duration(info['duration']), 'master': master, 'renditions': renditions, 'stats': stats,
+            'images': thumbnail_dir, 'media_info': info}
@@ -0,0 +1,365 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Request, SQL, template and ffmpeg instrumentation in Prometheus format.
+
+Every process (gunicorn workers, the transcode worker and its ffmpeg pool)
+keeps its counters and histograms in memory and writes them to
+`METRICS_FOLDER/<pid>-<start time>.json` at most every
+`METRICS_FLUSH_SECONDS`, so a process that gets the pid of an exited one
+starts a file of its own. `/metrics` adds up the files of all processes, so
+one scrape sees the whole host. When the app starts, the files of exited
+processes are added into `archive.json` and removed, so their counts stay
+part of the totals without leaving a file per process ever started. Merging
+and reading hold a lock on `archive.lock` (not available on Windows, where
+the files are simply kept).
+
+With `PROFILE_SLOW_REQUESTS` set to a number of seconds, a sampling thread
+records the stacks of in-flight requests every `PROFILE_INTERVAL` seconds,
+and requests slower than the threshold leave a flame graph in collapsed
+stack format (`flamegraph.pl` or speedscope read it) in `PROFILE_FOLDER`.
+"""
+
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from flask import before_render_template, g, request, template_rendered
+
+from processes import pid_alive
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SUBPROCESS_BUCKETS = (0.1, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'owu_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.', None),
+    'owu_http_request_duration_seconds': ('histogram', 'Time to handle a request.', LATENCY_BUCKETS),
+    'owu_sql_queries_per_request': ('histogram', 'SQL statements executed by one request.', QUERY_BUCKETS),
+    'owu_sql_seconds_per_request': ('histogram', 'Time one request spent in SQL statements.', LATENCY_BUCKETS),
+    'owu_template_render_seconds': ('histogram', 'Time to render a template, nested templates included.',
+                                    LATENCY_BUCKETS),
+    'owu_function_seconds': ('histogram', 'Time spent in instrumented helper functions.', LATENCY_BUCKETS),
+    'owu_subprocess_seconds': ('histogram', 'Duration of ffmpeg and ffprobe runs by exit code.',
+                               SUBPROCESS_BUCKETS),
+}
+ARCHIVE = 'archive.json'
+
+
+def _file_pid(path):
+    # <pid>-<start time>.json, or <pid>.json as written by older versions
+    return int(os.path.basename(path).split('.')[0].split('-')[0])
+
+
+def _add(totals, key, value):
+    if isinstance(value, list):
+        current = totals.setdefault(key, [0] * len(value))
+        for index, item in enumerate(value):
+            current[index] += item
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def _load(path, totals):
+    """Add the values of one process file to `totals`. Returns False if it cannot be read."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return False  # Being replaced right now
+    for name, labels, value in data:
+        if name in METRICS:
+            _add(totals, (name, tuple(tuple(label) for label in labels)), value)
+    return True
+
+
+def _dump(totals, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump([[name, list(labels), value] for (name, labels), value in totals.items()], f)
+    os.replace(path + '.tmp', path)
+
+
+class Registry:
+
+    def __init__(self):
+        self.folder = None
+        self.flush_seconds = 5.0
+        # (name, labels) -> count, or [count per bucket..., sum, count] for histograms
+        self._values = {}
+        self._next_flush = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._file = f'{os.getpid()}-{time.time_ns()}.json'
+
+    def reset(self):
+        """Forget the values copied from the parent of a forked process."""
+        self._values = {}
+        self._next_flush = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._file = f'{os.getpid()}-{time.time_ns()}.json'
+
+    def _folder_lock(self, exclusive):
+        """Open file to hold while reading or merging the process files, None without fcntl."""
+        if fcntl is None:
+            return None
+        os.makedirs(self.folder, exist_ok=True)
+        lock = open(os.path.join(self.folder, 'archive.lock'), 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return lock
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.maybe_flush()
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+        self.maybe_flush()
+
+    def maybe_flush(self, force=False):
+        now = time.monotonic()
+        if self.folder is None or (now < self._next_flush and not force):
+            return
+        if not self._flush_lock.acquire(blocking=force):
+            return  # Another thread is writing the file
+        try:
+            self._next_flush = now + self.flush_seconds
+            with self._lock:
+                data = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+            os.makedirs(self.folder, exist_ok=True)
+            path = os.path.join(self.folder, self._file)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(path + '.tmp', path)
+        finally:
+            self._flush_lock.release()
+
+    def compact(self):
+        """Add the files of exited processes into the archive and remove them. Returns how many went."""
+        lock = self._folder_lock(exclusive=True) if self.folder else None
+        if lock is None:
+            return 0
+        with lock:
+            archive = os.path.join(self.folder, ARCHIVE)
+            dead = [path for path in glob.glob(os.path.join(self.folder, '*.json'))
+                    if path != archive and not pid_alive(_file_pid(path))]
+            if not dead:
+                return 0
+            totals = {}
+            _load(archive, totals)
+            dead = [path for path in dead if _load(path, totals)]
+            _dump(totals, archive)
+            for path in dead:
+                os.remove(path)
+        return len(dead)
+
+    def collect(self):
+        """Values of every process, this one's live."""
+        totals = {}
+        if self.folder:
+            lock = self._folder_lock(exclusive=False)
+            try:
+                for path in glob.glob(os.path.join(self.folder, '*.json')):
+                    if os.path.basename(path) != self._file:
+                        _load(path, totals)
+            finally:
+                if lock is not None:
+                    lock.close()
+        with self._lock:
+            for key, value in self._values.items():
+                _add(totals, key, list(value) if isinstance(value, list) else value)
+        return totals
+
+
+registry = Registry()
+if hasattr(os, 'register_at_fork'):  # Not on Windows, where children are spawned fresh
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+def configure(folder, flush_seconds):
+    """Point this process's registry at `folder`. Also the initializer of process pools, see tasks.py."""
+    registry.folder = folder
+    registry.flush_seconds = flush_seconds
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    by_name = {}
+    for (name, labels), value in sorted(registry.collect().items()):
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for labels, value in by_name.get(name, ()):
+            if kind == 'counter':
+                lines.append(f'{name}{_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {value[-1]}')
+            lines.append(f'{name}_sum{_labels(labels)} {value[-2]}')
+            lines.append(f'{name}_count{_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def timed(function):
+    """Record the duration of every call in owu_function_seconds."""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            registry.observe('owu_function_seconds', time.perf_counter() - started, function=function.__name__)
+    return wrapper
+
+
+def record_subprocess(program, stage, exit_code, seconds):
+    registry.observe('owu_subprocess_seconds', seconds, program=program, stage=stage, exit_code=exit_code)
+    # ffmpeg runs are rare and often in short-lived pool processes
+    registry.maybe_flush(force=True)
+
+
+class SamplingProfiler:
+    """Samples the stacks of registered threads from one background thread."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def reset(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._samples[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._samples.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                thread_ids = list(self._samples)
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    module = frame.f_globals.get('__name__', '?')
+                    stack.append(f'{code.co_name} ({module}:{frame.f_lineno})')
+                    frame = frame.f_back
+                with self._lock:
+                    samples = self._samples.get(thread_id)
+                    if samples is not None and stack:
+                        samples[';'.join(reversed(stack))] += 1
+
+
+profiler = SamplingProfiler()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=profiler.reset)
+
+
+def _dump_profile(folder, endpoint, seconds, samples):
+    os.makedirs(folder, exist_ok=True)
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{endpoint or 'unknown'}-{int(seconds * 1000)}ms.folded"
+    with open(os.path.join(folder, name), 'w') as f:
+        for stack, count in samples.items():
+            f.write(f'{stack} {count}\n')
+
+
+def init_app(app):
+    # Imported here so media.py can record subprocesses without loading the models
+    from loaders import query_count, query_time
+
+    configure(app.config['METRICS_FOLDER'], app.config['METRICS_FLUSH_SECONDS'])
+    registry.compact()
+    profiler.interval = app.config['PROFILE_INTERVAL']
+    slow_request = app.config['PROFILE_SLOW_REQUESTS']
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        if slow_request is not None:
+            profiler.start(threading.get_ident())
+
+    @app.teardown_request
+    def record_request(error=None):
+        started = g.pop('request_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        status = g.pop('response_status', 500 if error else 200)
+        registry.inc('owu_http_requests_total', endpoint=endpoint, method=request.method, status=status)
+        registry.observe('owu_http_request_duration_seconds', elapsed, endpoint=endpoint)
+        registry.observe('owu_sql_queries_per_request', query_count(), endpoint=endpoint)
+        registry.observe('owu_sql_seconds_per_request', query_time(), endpoint=endpoint)
+        if slow_request is not None:
+            samples = profiler.stop(threading.get_ident())
+            if samples and elapsed >= slow_request:
+                _dump_profile(app.config['PROFILE_FOLDER'], request.endpoint, elapsed, samples)
+
+    @app.after_request
+    def remember_status(response):
+        g.response_status = response.status_code
+        return response
+
+    def template_started(sender, template, context, **extra):
+        g.setdefault('template_starts', []).append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        starts = g.get('template_starts')
+        if starts:
+            registry.observe('owu_template_render_seconds', time.perf_counter() - starts.pop(),
+                             template=template.name)
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
@@ -0,0 +1,55 @@
+"""drop legacy rendition columns
+
+Revision ID: 93651c0c6afc
+Revises: edabd7817764
+Create Date: 2026-10-17 00:46:25.243057
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '93651c0c6afc'
+down_revision = 'edabd7817764'
+branch_labels = None
+depends_on = None
+
+
+# Quality -> (legacy column, width, height), as in edabd7817764
+LEGACY_COLUMNS = {
+    '4K': ('filename_4k', 3840, 2160),
+    'QHD': ('filename_2k', 2560, 1440),
+    '1080p': ('filename_1080p', 1920, 1080),
+    '720p': ('filename_720p', 1280, 720),
+    '480p': ('filename_480p', 854, 480),
+    '360p': ('filename_360p', 640, 360),
+}
+
+
+def upgrade():
+    # Pick up videos the previous release wrote during the rollout
+    for quality, (column, width, height) in LEGACY_COLUMNS.items():
+        op.execute(sa.text(
+            f"INSERT INTO video_rendition (video_id, quality, width, height, codec, path) "
+            f"SELECT video.video_id, :quality, :width, :height, 'h264', video.{column} FROM video "
+            f"WHERE video.{column} IS NOT NULL AND NOT EXISTS ("
+            f"SELECT 1 FROM video_rendition WHERE video_rendition.video_id = video.video_id "
+            f"AND video_rendition.quality = :quality)"
+        ).bindparams(quality=quality, width=width, height=height))
+
+    with op.batch_alter_table('video', schema=None) as batch_op:
+        for column, _, _ in LEGACY_COLUMNS.values():
+            batch_op.drop_column(column)
+
+
+def downgrade():
+    with op.batch_alter_table('video', schema=None) as batch_op:
+        for column, _, _ in LEGACY_COLUMNS.values():
+            batch_op.add_column(sa.Column(column, sa.VARCHAR(length=120), nullable=True))
+
+    for quality, (column, _, _) in LEGACY_COLUMNS.items():
+        op.execute(sa.text(
+            f"UPDATE video SET {column} = (SELECT path FROM video_rendition "
+            f"WHERE video_rendition.video_id = video.video_id AND video_rendition.quality = :quality)"
+        ).bindparams(quality=quality))
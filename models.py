@@ -1,9 +1,12 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, select, update
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
-db = SQLAlchemy()
+from database import RoutingSession, insert_ignore
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class User(db.Model, UserMixin):
@@ -16,6 +19,10 @@ class User(db.Model, UserMixin):
     channel_name = db.Column(db.String(150), nullable=False)
     channel_description = db.Column(db.String(150), nullable=True)
     avatar_filename = db.Column(db.String(150), nullable=True)
+    # Maintained together with Subscription rows, see subscribe()/unsubscribe() and reconcile_counters()
+    subscriber_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Suggested videos of the channel computed before this are stale, see recommendations.py
+    recommendations_stale_at = db.Column(db.DateTime, nullable=True)
 
     videos = db.relationship('Video', backref='uploader', lazy=True)
     likes = db.relationship('Like', back_populates='user', lazy=True)  # Added back_populates
@@ -51,16 +58,24 @@ class User(db.Model, UserMixin):
         return f'<User {self.username}>'
 
     def subscribe(self, user):
-        if not self.is_subscribed(user):
-            subscription = Subscription(subscriber_id=self.id, subscribed_to_id=user.id)
-            db.session.add(subscription)
+        """Subscribe to `user` and bump their counter in one transaction. Returns False if already subscribed."""
+        if not insert_ignore(db.session, Subscription, subscriber_id=self.id, subscribed_to_id=user.id):
             db.session.commit()
+            return False
+        db.session.execute(update(User).where(User.id == user.id)
+                           .values(subscriber_count=User.subscriber_count + 1))
+        analytics.record_subscription(user.id, 1)
+        db.session.commit()
+        return True
 
     def unsubscribe(self, user):
-        subscription = Subscription.query.filter_by(subscriber_id=self.id, subscribed_to_id=user.id).first()
-        if subscription:
-            db.session.delete(subscription)
-            db.session.commit()
+        deleted = Subscription.query.filter_by(subscriber_id=self.id, subscribed_to_id=user.id).delete()
+        if deleted:
+            db.session.execute(update(User).where(User.id == user.id)
+                               .values(subscriber_count=User.subscriber_count - deleted))
+            analytics.record_subscription(user.id, -deleted)
+        db.session.commit()
+        return bool(deleted)
 
     def is_subscribed(self, user):
         return Subscription.query.filter_by(subscriber_id=self.id, subscribed_to_id=user.id).count() > 0
@@ -74,37 +89,111 @@ class User(db.Model, UserMixin):
             Subscription.subscribed_to_id == self.id).all()
 
     def subscribers_count(self):
-        return Subscription.query.filter_by(subscribed_to_id=self.id).count()
+        return self.subscriber_count
+
+    def toggle_like(self, video):
+        """Like or un-like `video`, keeping Video.likes in step. Returns True if the video is now liked."""
+        deleted = Like.query.filter_by(user_id=self.id, video_id=video.video_id).delete()
+        if deleted:
+            db.session.execute(update(Video).where(Video.id == video.id)
+                               .values(likes=Video.likes - deleted))
+            analytics.record_like(video.video_id, -deleted)
+            db.session.commit()
+            return False
+        if not insert_ignore(db.session, Like, user_id=self.id, video_id=video.video_id):
+            # A concurrent request liked it first
+            db.session.commit()
+            return True
+        db.session.execute(update(Video).where(Video.id == video.id).values(likes=Video.likes + 1))
+        analytics.record_like(video.video_id, 1)
+        db.session.commit()
+        return True
 
 
 class Video(db.Model):
     __tablename__ = 'video'
 
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+
+    # Keyset pagination of the home feed walks this index
+    __table_args__ = (
+        db.Index('ix_video_created_at_id', 'created_at', 'id'),
+        # Channel page and same-uploader recommendations
+        db.Index('ix_video_user_id_created_at', 'user_id', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     video_id = db.Column(db.String(32), unique=True, nullable=False)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    filename_4k = db.Column(db.String(120), nullable=True)
-    filename_2k = db.Column(db.String(120), nullable=True)
-    filename_1080p = db.Column(db.String(120), nullable=True)
-    filename_720p = db.Column(db.String(120), nullable=True)
-    filename_480p = db.Column(db.String(120), nullable=True)
-    filename_360p = db.Column(db.String(120), nullable=True)
+    # SHA-256 of the uploaded source, uploads of the same file share their renditions
+    source_digest = db.Column(db.String(64), nullable=True, index=True)
+    # HLS master playlist, relative to UPLOAD_FOLDER. Older uploads only have progressive MP4 files.
+    hls_playlist = db.Column(db.String(150), nullable=True)
     thumbnail_filename = db.Column(db.String(120), nullable=True)
+    # Directory under THUMBNAIL_FOLDER with the sized posters and the storyboard, see media.generate_images.
+    # Older uploads only have thumbnail_filename.
+    thumbnail_dir = db.Column(db.String(150), nullable=True)
     views = db.Column(db.Integer, default=0)
     likes = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.now)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     liked_by = db.relationship('Like', back_populates='video', lazy='dynamic')  # Updated back_populates
     user = db.relationship('User', backref='user_videos', lazy=True)
+    renditions = db.relationship('VideoRendition', backref='video', lazy=True,
+                                 order_by='VideoRendition.height.desc()', cascade='all, delete-orphan')
     duration = db.Column(db.String(50), nullable=True)  # Added duration field
+    status = db.Column(db.String(20), nullable=False, default=STATUS_READY, server_default=STATUS_READY)
+    # Suggested videos bookkeeping, see recommendations.py
+    recommendations_stale = db.Column(db.Boolean, nullable=False, default=True, server_default='1')
+    recommendations_updated_at = db.Column(db.DateTime, nullable=True)
+
+    @property
+    def is_ready(self):
+        return self.status == self.STATUS_READY
+
+    @property
+    def storyboard(self):
+        return f'{self.thumbnail_dir}/storyboard.vtt' if self.thumbnail_dir else None
 
     def __repr__(self):
         return f'<Video {self.title}>'
 
 
+class VideoRendition(db.Model):
+    """One rung of a video's HLS ladder."""
+    __tablename__ = 'video_rendition'
+
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.String(32), db.ForeignKey('video.video_id'), nullable=False)
+    quality = db.Column(db.String(20), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    codec = db.Column(db.String(20), nullable=True)
+    # Peak bits per second, as advertised in the master playlist
+    bitrate = db.Column(db.Integer, nullable=True)
+    # Bytes on disk for the playlist and its segments
+    size = db.Column(db.BigInteger, nullable=True)
+    # Playlist, relative to UPLOAD_FOLDER
+    path = db.Column(db.String(150), nullable=False, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('video_id', 'quality', name='uq_video_rendition_video_quality'),
+    )
+
+    @property
+    def label(self):
+        """Label by frame height as the player shows it, e.g. '1440p' for the QHD rung."""
+        return f'{self.height}p'
+
+
 class Like(db.Model):
     __tablename__ = 'like'
+    __table_args__ = (
+        db.Index('ix_like_video_id', 'video_id'),
+    )
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
     video_id = db.Column(db.String(32), db.ForeignKey('video.video_id'), primary_key=True)
@@ -114,6 +203,10 @@ class Like(db.Model):
 
 class Subscription(db.Model):
     __tablename__ = 'subscription'
+    # The primary key covers lookups by subscriber, this one lookups by channel
+    __table_args__ = (
+        db.Index('ix_subscription_subscribed_to_id', 'subscribed_to_id'),
+    )
 
     subscriber_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
     subscribed_to_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
@@ -122,3 +215,185 @@ class Subscription(db.Model):
     # Определяем отношения
     subscriber = db.relationship('User', foreign_keys=[subscriber_id], backref='subscriptions')
     subscribed_to = db.relationship('User', foreign_keys=[subscribed_to_id], backref='subscribers')
+
+
+class Recommendation(db.Model):
+    __tablename__ = 'recommendation'
+
+    video_id = db.Column(db.String(32), db.ForeignKey('video.video_id'), primary_key=True)
+    candidate_id = db.Column(db.String(32), db.ForeignKey('video.video_id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_recommendation_video_score', 'video_id', 'score'),
+    )
+
+
+class ChannelStats(db.Model):
+    """Running totals of a channel, kept up to date by analytics.py."""
+    __tablename__ = 'channel_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    video_count = db.Column(db.Integer, nullable=False, default=0)
+    views = db.Column(db.BigInteger, nullable=False, default=0)
+    likes = db.Column(db.BigInteger, nullable=False, default=0)
+    subscribers = db.Column(db.Integer, nullable=False, default=0)
+
+
+class VideoDailyStats(db.Model):
+    """Views and net likes a video got on one day, see analytics.py."""
+    __tablename__ = 'video_daily_stats'
+    # Daily totals of a channel add up its videos' rows through this index
+    __table_args__ = (
+        db.Index('ix_video_daily_stats_user_id_day', 'user_id', 'day'),
+    )
+
+    video_id = db.Column(db.String(32), db.ForeignKey('video.video_id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    # The video's channel, copied so channel series don't join video
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    views = db.Column(db.Integer, nullable=False, default=0)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CacheTag(db.Model):
+    """Version counter of a fragment cache tag, see cache.py."""
+    __tablename__ = 'cache_tag'
+
+    tag = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+
+class StoredObject(db.Model):
+    """Reference count of a content-addressed file or directory, see storage.py."""
+    __tablename__ = 'stored_object'
+
+    kind = db.Column(db.String(20), primary_key=True)
+    path = db.Column(db.String(150), primary_key=True)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class CachedRendition(db.Model):
+    """A rung encoded on demand from a mezzanine, see renditions.py."""
+    __tablename__ = 'cached_rendition'
+
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+
+    # Renditions directory, relative to UPLOAD_FOLDER
+    directory = db.Column(db.String(150), primary_key=True)
+    quality = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PENDING)
+    size = db.Column(db.BigInteger, nullable=True)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class MediaInfo(db.Model):
+    """Source file metadata from media.probe()."""
+    __tablename__ = 'media_info'
+
+    video_id = db.Column(db.String(32), db.ForeignKey('video.video_id'), primary_key=True)
+    duration = db.Column(db.Float, nullable=False)
+    container = db.Column(db.String(50), nullable=True)
+    bitrate = db.Column(db.Integer, nullable=True)
+    video_codec = db.Column(db.String(20), nullable=True)
+    pixel_format = db.Column(db.String(20), nullable=True)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    fps = db.Column(db.Float, nullable=True)
+    video_bitrate = db.Column(db.Integer, nullable=True)
+    rotation = db.Column(db.Integer, nullable=False, default=0)
+    audio_codec = db.Column(db.String(20), nullable=True)
+    audio_channels = db.Column(db.Integer, nullable=True)
+    audio_layout = db.Column(db.String(30), nullable=True)
+    audio_sample_rate = db.Column(db.Integer, nullable=True)
+    audio_bitrate = db.Column(db.Integer, nullable=True)
+
+    video = db.relationship('Video', backref=db.backref('media_info', uselist=False))
+
+    def to_dict(self):
+        return {column.key: getattr(self, column.key) for column in self.__table__.columns if column.key != 'video_id'}
+
+
+class UploadSession(db.Model):
+    """A resumable upload in progress, see uploads.py."""
+    __tablename__ = 'upload_session'
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    title = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    # Pushed forward by every chunk, abandoned sessions are removed after it
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    chunks = db.relationship('UploadChunk', backref='session', lazy='dynamic', cascade='all, delete-orphan')
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+
+class UploadChunk(db.Model):
+    __tablename__ = 'upload_chunk'
+
+    session_id = db.Column(db.String(32), db.ForeignKey('upload_session.id'), primary_key=True)
+    index = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+
+
+class TranscodeJob(db.Model):
+    __tablename__ = 'transcode_job'
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.String(32), db.ForeignKey('video.video_id'), nullable=False)
+    source_path = db.Column(db.String(255), nullable=False)
+    # Output directories, relative to UPLOAD_FOLDER and THUMBNAIL_FOLDER
+    base_filename = db.Column(db.String(150), nullable=False)
+    thumbnail_dir = db.Column(db.String(150), nullable=False)
+    # Poster image supplied by the uploader, empty to take a frame of the video
+    thumbnail_path = db.Column(db.String(255), nullable=True)
+    # Set for jobs that encode one rung of an on-demand video from its mezzanine
+    quality = db.Column(db.String(20), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_QUEUED, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    # JSON with wall/CPU seconds per rendition, see media.generate_video_variants
+    stats = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    # Renewed by the worker running the job, see TranscodeWorker.requeue_stale
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    video = db.relationship('Video', backref=db.backref('transcode_jobs', lazy='dynamic'))
+
+    def __repr__(self):
+        return f'<TranscodeJob {self.id} {self.status}>'
+
+
+def reconcile_counters():
+    """Rebuild the denormalized like and subscriber counters from the source tables."""
+    db.session.execute(update(User).values(subscriber_count=select(func.count())
+                                           .where(Subscription.subscribed_to_id == User.id)
+                                           .scalar_subquery()))
+    db.session.execute(update(Video).values(likes=select(func.count())
+                                            .where(Like.video_id == Video.video_id)
+                                            .scalar_subquery()))
+    db.session.commit()
+
+
+# At the bottom: analytics.py imports the models above
+import analytics  # noqa: E402
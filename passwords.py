@@ -0,0 +1,113 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Password hashing off the request thread.
+
+Hashing and checking run in a small process pool (`PASSWORD_HASH_WORKERS`,
+0 hashes inline), so a burst of logins costs CPU on the pool's cores instead
+of holding the worker that serves everyone else. At most
+`PASSWORD_HASH_QUEUE` operations may be pending per process; past that a
+caller waits up to `PASSWORD_HASH_WAIT` seconds for a slot and then gets
+`HashingBusy`.
+
+`PASSWORD_HASH_METHOD` is any werkzeug method string, e.g. `scrypt:32768:8:1`
+or `pbkdf2:sha256:600000`. Hashes made with another method are replaced with
+a new one the next time their owner logs in.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Settings compared by `flask benchmark-passwords`
+BENCHMARK_METHODS = (
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+    'scrypt:65536:8:1',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha256:1000000',
+)
+
+
+class HashingBusy(Exception):
+    pass
+
+
+_pool = {'pid': None, 'executor': None, 'slots': None}
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    config = current_app.config
+    with _pool_lock:
+        # A pool inherited from the parent of a forked worker does not work
+        if _pool['pid'] != os.getpid():
+            _pool['executor'] = ProcessPoolExecutor(max_workers=config['PASSWORD_HASH_WORKERS'])
+            _pool['slots'] = threading.BoundedSemaphore(config['PASSWORD_HASH_QUEUE'])
+            _pool['pid'] = os.getpid()
+        return _pool['executor'], _pool['slots']
+
+
+def _run(function, *args):
+    if not current_app.config['PASSWORD_HASH_WORKERS']:
+        return function(*args)
+    executor, slots = _executor()
+    if not slots.acquire(timeout=current_app.config['PASSWORD_HASH_WAIT']):
+        raise HashingBusy()
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    config = current_app.config
+    return _run(generate_password_hash, password, config['PASSWORD_HASH_METHOD'], config['PASSWORD_SALT_LENGTH'])
+
+
+def check_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+def _parameters(method):
+    """`method` with werkzeug's defaults filled in, e.g. 'scrypt' -> ('scrypt', 32768, 8, 1)."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return name, n, r, p
+    if name == 'pbkdf2':
+        if len(args) > 2:
+            raise ValueError(method)
+        hash_name = args[0].lower() if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return name, hash_name, iterations
+    return (name, *args)
+
+
+def needs_rehash(password_hash):
+    try:
+        stored = _parameters(password_hash.split('$', 1)[0])
+    except ValueError:
+        return True
+    return stored != _parameters(current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def benchmark(methods=BENCHMARK_METHODS, seconds=2.0):
+    """Single-core password checks per second for each method, as (method, per_second)."""
+    results = []
+    for method in methods:
+        password_hash = generate_password_hash('benchmark-password', method)
+        checks = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            check_password_hash(password_hash, 'benchmark-password')
+            checks += 1
+        results.append((method, checks / (time.perf_counter() - started)))
+    return results
@@ -0,0 +1,150 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Rate-limit storage shared by all worker processes on one host.
+
+Registers the `sqlite://` scheme with `limits`, so Flask-Limiter can keep
+its counters in a small SQLite file (`RATELIMIT_STORAGE_URI`) instead of
+per-process memory. It implements fixed and sliding-window counters; a
+sliding-window check and its increment run in one `BEGIN IMMEDIATE`
+transaction, so concurrent workers cannot both take the last hit. Expired
+counters are purged every `PURGE_EVERY` writes, which keeps the file
+bounded by the number of clients active within the longest limit.
+
+Several hosts should point `RATELIMIT_STORAGE_URI` at Redis instead.
+"""
+
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from math import floor
+
+from limits.errors import ConfigurationError
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+PURGE_EVERY = 1000
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """`sqlite:///relative/path.db` or `sqlite:////absolute/path.db`."""
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri=None, wrap_exceptions=False, timeout=5.0, **options):
+        self.path = urllib.parse.urlparse(uri).path[1:]
+        if not self.path:
+            raise ConfigurationError(f'no database file in {uri}')
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        self._writes = itertools.count(1)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Not kept: connections must not be shared with processes forked later
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        with connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS counter ('
+                               'key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires REAL NOT NULL'
+                               ') WITHOUT ROWID')
+        connection.close()
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _incr(self, connection, key, expiry, amount, now):
+        if next(self._writes) % PURGE_EVERY == 0:
+            connection.execute('DELETE FROM counter WHERE expires <= ?', (now,))
+        # An expired counter starts over
+        return connection.execute(
+            'INSERT INTO counter (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            'value = CASE WHEN expires <= ? THEN excluded.value ELSE value + excluded.value END, '
+            'expires = CASE WHEN expires <= ? THEN excluded.expires ELSE expires END '
+            'RETURNING value',
+            (key, amount, now + expiry, now, now)).fetchone()[0]
+
+    def _get(self, connection, key, now):
+        row = connection.execute('SELECT value FROM counter WHERE key = ? AND expires > ?', (key, now)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key, expiry, amount=1):
+        with self._transaction() as connection:
+            return self._incr(connection, key, expiry, amount, time.time())
+
+    def get(self, key):
+        return self._get(self._connection(), key, time.time())
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection().execute('SELECT expires FROM counter WHERE key = ? AND expires > ?',
+                                         (key, now)).fetchone()
+        return row[0] if row else now
+
+    def check(self):
+        try:
+            self._connection().execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._transaction() as connection:
+            return connection.execute('DELETE FROM counter').rowcount
+
+    def clear(self, key):
+        self._connection().execute('DELETE FROM counter WHERE key = ?', (key,))
+
+    def _sliding_window(self, connection, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._get(connection, previous_key, now)
+        current_count = self._get(connection, current_key, now)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        with self._transaction() as connection:
+            previous_count, previous_ttl, current_count, _ = self._sliding_window(connection, key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            # The current window is still the previous one during the next window
+            self._incr(connection, self.sliding_window_keys(key, expiry, now)[1], 2 * expiry, amount, now)
+            return True
+
+    def get_sliding_window(self, key, expiry):
+        return self._sliding_window(self._connection(), key, expiry, time.time())
+
+    def clear_sliding_window(self, key, expiry):
+        for window_key in self.sliding_window_keys(key, expiry, time.time()):
+            self.clear(window_key)
@@ -0,0 +1,218 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Precomputed "suggested videos" for the watch page.
+
+Every video keeps at most `RECOMMENDATION_K` rows in the `recommendation`
+table, scored from four bounded signals:
+
+* co-likes: other videos liked by people who liked this one,
+* same uploader: the channel's other recent videos,
+* subscription overlap: recent videos of channels that share subscribers
+  with the uploader,
+* popularity: the most viewed and liked videos overall.
+
+The list of a new upload is computed by the transcoding worker. Likes only
+flag the affected videos as stale, uploads and subscriptions stamp the
+channel (`User.recommendations_stale_at`) and every list of the channel
+computed before that time counts as stale; a stale
+list is recomputed in a background thread the next time it is read (at most
+once per `RECOMMENDATION_REFRESH_SECONDS`) or by
+`flask refresh-recommendations`, so the watch page itself only ever reads
+the index.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, text, update
+from sqlalchemy.orm import joinedload
+
+import cache
+from models import db, Recommendation, User, Video
+
+logger = logging.getLogger(__name__)
+
+WEIGHTS = {
+    'co_like': 3.0,
+    'uploader': 2.0,
+    'subscription': 1.5,
+    'popular': 1.0,
+}
+# Co-likes are counted over a bounded sample of the video's likers
+MAX_LIKERS = 500
+RELATED_CHANNELS = 5
+
+_popular = {'expires': 0, 'scores': {}}
+_refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recommendations')
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+
+def _normalized(rows):
+    rows = list(rows)
+    if not rows:
+        return {}
+    top = max(score for _, score in rows) or 1
+    return {video_id: score / top for video_id, score in rows}
+
+
+def _co_likes(video, limit):
+    rows = db.session.execute(text(
+        'SELECT other.video_id, COUNT(*) AS score FROM "like" other '
+        'WHERE other.user_id IN (SELECT user_id FROM "like" WHERE video_id = :video_id LIMIT :max_likers) '
+        'AND other.video_id != :video_id '
+        'GROUP BY other.video_id ORDER BY score DESC LIMIT :limit'),
+        {'video_id': video.video_id, 'max_likers': MAX_LIKERS, 'limit': limit})
+    return _normalized(rows)
+
+
+def _same_uploader(video, limit):
+    rows = db.session.query(Video.video_id).filter(
+        Video.user_id == video.user_id,
+        Video.id != video.id,
+        Video.status == Video.STATUS_READY,
+    ).order_by(Video.created_at.desc()).limit(limit)
+    # Newer uploads rank slightly higher
+    return {row[0]: 1 - index / (2 * limit) for index, row in enumerate(rows)}
+
+
+def _subscription_overlap(video, limit):
+    channels = _normalized(db.session.execute(text(
+        'SELECT other.subscribed_to_id, COUNT(*) AS score FROM subscription other '
+        'JOIN subscription mine ON mine.subscriber_id = other.subscriber_id '
+        'WHERE mine.subscribed_to_id = :user_id AND other.subscribed_to_id != :user_id '
+        'GROUP BY other.subscribed_to_id ORDER BY score DESC LIMIT :channels'),
+        {'user_id': video.user_id, 'channels': RELATED_CHANNELS}))
+    scores = {}
+    per_channel = max(1, limit // max(1, len(channels)))
+    for user_id, channel_score in channels.items():
+        rows = db.session.query(Video.video_id).filter(
+            Video.user_id == user_id,
+            Video.status == Video.STATUS_READY,
+        ).order_by(Video.created_at.desc()).limit(per_channel)
+        for row in rows:
+            scores[row[0]] = channel_score
+    return scores
+
+
+def _popular_scores(limit):
+    """Globally popular videos, cached per process for a minute."""
+    if _popular['expires'] < time.monotonic():
+        rows = db.session.query(Video.video_id, Video.views + 10 * Video.likes) \
+            .filter(Video.status == Video.STATUS_READY) \
+            .order_by((Video.views + 10 * Video.likes).desc()).limit(limit)
+        _popular['scores'] = _normalized(rows)
+        _popular['expires'] = time.monotonic() + 60
+    return _popular['scores']
+
+
+def compute(video, k):
+    """Score candidates for `video` and return the best `k` as (video_id, score)."""
+    scores = {}
+    signals = {
+        'co_like': _co_likes(video, k),
+        'uploader': _same_uploader(video, k),
+        'subscription': _subscription_overlap(video, k),
+        'popular': _popular_scores(k),
+    }
+    for name, candidates in signals.items():
+        for candidate_id, score in candidates.items():
+            if candidate_id != video.video_id:
+                scores[candidate_id] = scores.get(candidate_id, 0) + WEIGHTS[name] * score
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def refresh(video):
+    k = current_app.config['RECOMMENDATION_K']
+    # Channel events during the computation leave the list stale
+    started = datetime.now()
+    Recommendation.query.filter_by(video_id=video.video_id).delete()
+    db.session.add_all(Recommendation(video_id=video.video_id, candidate_id=candidate_id, score=score)
+                       for candidate_id, score in compute(video, k))
+    video.recommendations_stale = False
+    video.recommendations_updated_at = started
+    cache.invalidate(f'recommendations:{video.video_id}')
+    db.session.commit()
+
+
+def mark_stale(*video_ids):
+    """Flag videos whose candidate lists are affected by an event. The caller commits."""
+    if video_ids:
+        db.session.execute(update(Video).where(Video.video_id.in_(video_ids))
+                           .values(recommendations_stale=True))
+
+
+def mark_channel_stale(user_id):
+    """Flag every list of a channel's videos with one row update. The caller commits."""
+    db.session.execute(update(User).where(User.id == user_id)
+                       .values(recommendations_stale_at=datetime.now()))
+
+
+def _stale(video):
+    stale_at = video.user.recommendations_stale_at
+    return video.recommendations_stale or (stale_at is not None and stale_at > video.recommendations_updated_at)
+
+
+def _due(video):
+    min_age = timedelta(seconds=current_app.config['RECOMMENDATION_REFRESH_SECONDS'])
+    return _stale(video) and video.recommendations_updated_at < datetime.now() - min_age
+
+
+def _refresh_in_background(app, video_id):
+    try:
+        with app.app_context():
+            video = Video.query.filter_by(video_id=video_id).first()
+            if video is not None:
+                refresh(video)
+    except Exception:
+        logger.exception('Refreshing suggested videos of %s failed', video_id)
+    finally:
+        with _scheduled_lock:
+            _scheduled.discard(video_id)
+
+
+def schedule_refresh(video):
+    with _scheduled_lock:
+        if video.video_id in _scheduled:
+            return
+        _scheduled.add(video.video_id)
+    _refresher.submit(_refresh_in_background, current_app._get_current_object(), video.video_id)
+
+
+def ensure_fresh(video):
+    """Queue a background refresh of a stale list; the page shows the current one meanwhile."""
+    if video.recommendations_updated_at is None or _due(video):
+        # A list never computed (a video not backfilled yet) starts out empty
+        schedule_refresh(video)
+
+
+def suggested_videos(video, limit=20):
+    """Read up to `limit` precomputed suggestions."""
+    return Video.query.join(Recommendation, Recommendation.candidate_id == Video.video_id) \
+        .filter(Recommendation.video_id == video.video_id, Video.status == Video.STATUS_READY) \
+        .options(joinedload(Video.user)) \
+        .order_by(Recommendation.score.desc()).limit(limit).all()
+
+
+def refresh_stale(batch_size=500):
+    """Recompute every stale or never computed list. Returns the number refreshed."""
+    refreshed = 0
+    while True:
+        videos = Video.query.join(User, User.id == Video.user_id).filter(
+            Video.status == Video.STATUS_READY,
+            or_(Video.recommendations_stale == True,  # noqa: E712
+                Video.recommendations_updated_at == None,  # noqa: E711
+                User.recommendations_stale_at > Video.recommendations_updated_at),
+        ).order_by(Video.id).limit(batch_size).all()
+        if not videos:
+            return refreshed
+        for video in videos:
+            refresh(video)
+        refreshed += len(videos)
@@ -0,0 +1,117 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""On-demand renditions and their disk-budgeted cache.
+
+With `TRANSCODE_MODE = 'on_demand'` an upload only gets its
+`TRANSCODE_DEFAULT_QUALITY` rung, a master playlist listing the whole ladder
+and the source kept as `mezzanine` in the renditions directory. The first
+request for a missing rung playlist queues a `TranscodeJob` for that rung and
+gets a 503 with `Retry-After`, so the player stays on a rung it has. The
+`cached_rendition` row is inserted before the job, so concurrent requests for
+the same rung coalesce onto one job.
+
+Rungs encoded on demand are a cache: once their total size exceeds
+`RENDITION_CACHE_BUDGET`, the least recently played are deleted until it
+fits again, and are encoded anew when they are requested again. The default
+rung and the mezzanine have no row and are never evicted.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, update
+
+from database import insert_ignore
+import media
+from models import db, CachedRendition, TranscodeJob, Video, VideoRendition
+
+# Playlist fetches don't move a rung in the LRU more often than this
+_touched = {}
+_touched_lock = threading.Lock()
+MAX_TOUCHED = 10000
+
+
+def mezzanine_path(directory):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], directory, media.MEZZANINE_NAME)
+
+
+def request(path):
+    """Queue the rung whose playlist `path` is missing. The caller commits.
+
+    Returns False when `path` is not a rung that can be encoded on demand,
+    or its encode has failed for good.
+    """
+    rendition = VideoRendition.query.filter_by(path=path).first()
+    if rendition is None:
+        return False
+    directory = os.path.dirname(path)
+    if not os.path.exists(mezzanine_path(directory)):
+        return False
+    entry = db.session.get(CachedRendition, (directory, rendition.quality))
+    if entry is None:
+        if not insert_ignore(db.session, CachedRendition, directory=directory, quality=rendition.quality):
+            return True  # Another request queued it first
+    elif entry.status == CachedRendition.STATUS_FAILED:
+        return False
+    elif entry.status == CachedRendition.STATUS_PENDING:
+        return True
+    elif not db.session.execute(update(CachedRendition)
+                                .where(CachedRendition.directory == directory,
+                                       CachedRendition.quality == rendition.quality,
+                                       CachedRendition.status == CachedRendition.STATUS_READY)
+                                .values(status=CachedRendition.STATUS_PENDING)).rowcount:
+        return True  # Ready row whose files were deleted; someone else requeued it
+    thumbnail_dir = db.session.query(Video.thumbnail_dir).filter_by(video_id=rendition.video_id).scalar()
+    db.session.add(TranscodeJob(
+        video_id=rendition.video_id,
+        source_path=mezzanine_path(directory),
+        base_filename=directory,
+        thumbnail_dir=thumbnail_dir or '',
+        quality=rendition.quality,
+    ))
+    return True
+
+
+def touch(path):
+    """Mark the rung of playlist `path` as played now."""
+    touch_seconds = current_app.config['RENDITION_TOUCH_SECONDS']
+    now = time.monotonic()
+    with _touched_lock:
+        if now - _touched.get(path, -touch_seconds) < touch_seconds:
+            return
+        if len(_touched) >= MAX_TOUCHED:
+            _touched.clear()
+        _touched[path] = now
+    quality = os.path.splitext(os.path.basename(path))[0]
+    db.session.execute(update(CachedRendition)
+                       .where(CachedRendition.directory == os.path.dirname(path),
+                              CachedRendition.quality == quality,
+                              CachedRendition.last_used_at < datetime.now() - timedelta(seconds=touch_seconds))
+                       .values(last_used_at=datetime.now()))
+    db.session.commit()
+
+
+def evict(budget=None):
+    """Delete the least recently played rungs until the cache fits its budget. Returns how many went."""
+    budget = current_app.config['RENDITION_CACHE_BUDGET'] if budget is None else budget
+    ready = CachedRendition.status == CachedRendition.STATUS_READY
+    total = db.session.query(func.coalesce(func.sum(CachedRendition.size), 0)).filter(ready).scalar()
+    victims = []
+    for entry in CachedRendition.query.filter(ready).order_by(CachedRendition.last_used_at):
+        if total <= budget:
+            break
+        total -= entry.size or 0
+        victims.append(entry)
+    for entry in victims:
+        VideoRendition.query.filter_by(path=f'{entry.directory}/{entry.quality}.m3u8').update({'size': None})
+        db.session.delete(entry)
+    db.session.commit()
+    for entry in victims:
+        media.remove_rendition(os.path.join(current_app.config['UPLOAD_FOLDER'], entry.directory), entry.quality)
+    return len(victims)
@@ -0,0 +1,142 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""SQLite FTS5 index for video and channel search.
+
+`video_search` holds one row per ready video (rowid = video.id) with its
+title, description and channel name; `channel_search` one row per user
+(rowid = user.id). The index functions write through the current session,
+so they commit together with the change they mirror. On other databases
+search falls back to `LIKE` scans.
+"""
+
+import re
+
+from sqlalchemy import DDL, event, or_, text
+from sqlalchemy.orm import joinedload
+
+from models import db, User, Video
+
+# bm25() column weights: a title hit counts more than a channel hit, which
+# counts more than a hit in the description
+VIDEO_WEIGHTS = (10.0, 1.0, 4.0)
+CHANNEL_WEIGHTS = (4.0, 4.0, 1.0)
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+for statement in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS video_search USING fts5("
+    "title, description, channel, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS channel_search USING fts5("
+    "username, channel_name, channel_description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+):
+    event.listen(db.metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+
+def fts_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    tokens = TOKEN.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def index_video(video):
+    if not fts_enabled():
+        return
+    db.session.execute(text("DELETE FROM video_search WHERE rowid = :id"), {'id': video.id})
+    db.session.execute(
+        text("INSERT INTO video_search (rowid, title, description, channel) "
+             "VALUES (:id, :title, :description, :channel)"),
+        {'id': video.id, 'title': video.title, 'description': video.description or '',
+         'channel': video.user.username},
+    )
+
+
+def unindex_video(video):
+    if fts_enabled():
+        db.session.execute(text("DELETE FROM video_search WHERE rowid = :id"), {'id': video.id})
+
+
+def index_channel(user):
+    """(Re)index a channel and the channel name on all of its videos."""
+    if not fts_enabled():
+        return
+    db.session.execute(text("DELETE FROM channel_search WHERE rowid = :id"), {'id': user.id})
+    db.session.execute(
+        text("INSERT INTO channel_search (rowid, username, channel_name, channel_description) "
+             "VALUES (:id, :username, :channel_name, :channel_description)"),
+        {'id': user.id, 'username': user.username, 'channel_name': user.channel_name,
+         'channel_description': user.channel_description or ''},
+    )
+    db.session.execute(
+        text("UPDATE video_search SET channel = :channel "
+             "WHERE rowid IN (SELECT id FROM video WHERE user_id = :user_id)"),
+        {'channel': user.username, 'user_id': user.id},
+    )
+
+
+def rebuild():
+    """Drop and repopulate both indexes from the source tables."""
+    if not fts_enabled():
+        return
+    db.session.execute(text("DELETE FROM video_search"))
+    db.session.execute(text("DELETE FROM channel_search"))
+    db.session.execute(text(
+        "INSERT INTO video_search (rowid, title, description, channel) "
+        "SELECT video.id, video.title, coalesce(video.description, ''), user.username "
+        "FROM video JOIN user ON user.id = video.user_id WHERE video.status = :ready"),
+        {'ready': Video.STATUS_READY})
+    db.session.execute(text(
+        "INSERT INTO channel_search (rowid, username, channel_name, channel_description) "
+        "SELECT id, username, channel_name, coalesce(channel_description, '') FROM user"))
+    db.session.commit()
+
+
+def _ranked_ids(table, weights, query, limit, offset):
+    expression = match_expression(query)
+    if not expression:
+        return []
+    rows = db.session.execute(
+        text(f"SELECT rowid FROM {table} WHERE {table} MATCH :query "
+             f"ORDER BY bm25({table}, {', '.join(map(str, weights))}) LIMIT :limit OFFSET :offset"),
+        {'query': expression, 'limit': limit, 'offset': offset},
+    )
+    return [row[0] for row in rows]
+
+
+def _in_order(model, ids, *options):
+    if not ids:
+        return []
+    by_id = {item.id: item for item in model.query.filter(model.id.in_(ids)).options(*options).all()}
+    return [by_id[item_id] for item_id in ids if item_id in by_id]
+
+
+def search_videos(query, page=1, page_size=24):
+    """Ready videos matching `query`, best match first. Returns `(videos, has_more)`."""
+    offset = (page - 1) * page_size
+    if fts_enabled():
+        ids = _ranked_ids('video_search', VIDEO_WEIGHTS, query, page_size + 1, offset)
+        has_more = len(ids) > page_size
+        videos = [video for video in _in_order(Video, ids[:page_size], joinedload(Video.user)) if video.is_ready]
+        return videos, has_more
+
+    videos = Video.query.join(User, User.id == Video.user_id).filter(
+        Video.status == Video.STATUS_READY,
+        or_(
+            Video.title.contains(query),
+            User.username.contains(query)
+        )
+    ).options(joinedload(Video.user)) \
+        .order_by(Video.created_at.desc(), Video.id.desc()).limit(page_size + 1).offset(offset).all()
+    return videos[:page_size], len(videos) > page_size
+
+
+def search_channels(query, limit=12):
+    if fts_enabled():
+        return _in_order(User, _ranked_ids('channel_search', CHANNEL_WEIGHTS, query, limit, 0))
+    return User.query.filter(User.username.ilike(f'%{query}%')).limit(limit).all()
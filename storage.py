@@ -0,0 +1,142 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Content-addressed storage for avatars, thumbnails and transcoded videos.
+
+Files and output directories are named after the SHA-256 of their source,
+sharded by the first two byte pairs of the digest: `<folder>/ab/cd/abcd…`.
+Identical uploads end up at the same path, and since the content behind a
+path never changes, its URL can be cached forever.
+
+`StoredObject` rows count the references to every stored path. Taking and
+dropping references runs in the caller's transaction; a path whose count
+drops to zero is deleted from disk once that transaction commits.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from database import insert_ignore
+from models import db, StoredObject
+
+CHUNK_SIZE = 1024 * 1024
+CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(?:[./]|$)')
+
+# Storage kind -> config key of the folder it lives in
+FOLDERS = {
+    'avatar': 'UPLOAD_AVATAR_FOLDER',
+    'renditions': 'UPLOAD_FOLDER',
+    'images': 'THUMBNAIL_FOLDER',
+}
+_folders = {}
+
+
+def init_app(app):
+    for kind, key in FOLDERS.items():
+        _folders[kind] = app.config[key]
+
+
+def shard_path(digest, extension=''):
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_content_addressed(path):
+    return bool(CONTENT_ADDRESSED.match(path))
+
+
+def combine(*digests):
+    """Digest identifying output derived from several inputs."""
+    return hashlib.sha256(':'.join(digests).encode()).hexdigest()
+
+
+def write_stream(stream, path):
+    """Copy `stream` to `path`, hashing it on the way. Returns the hex digest."""
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        while chunk := stream.read(CHUNK_SIZE):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save(stream, kind, extension=''):
+    """Store the content of `stream` and return its path relative to the kind's folder.
+
+    Does not take a reference, see acquire.
+    """
+    folder = _folders[kind]
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    os.close(fd)
+    try:
+        path = shard_path(write_stream(stream, temp_path), extension.lower())
+        final_path = os.path.join(folder, path)
+        if os.path.exists(final_path):
+            return path  # Already stored
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path)
+        return path
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def acquire(kind, path):
+    """Take a reference to a stored path. The caller commits."""
+    updated = db.session.execute(update(StoredObject).where(StoredObject.kind == kind, StoredObject.path == path)
+                                 .values(refcount=StoredObject.refcount + 1)).rowcount
+    if not updated:
+        if not insert_ignore(db.session, StoredObject, kind=kind, path=path, refcount=1):
+            db.session.execute(update(StoredObject).where(StoredObject.kind == kind, StoredObject.path == path)
+                               .values(refcount=StoredObject.refcount + 1))
+    _orphans(db.session).discard((kind, path))
+
+
+def release(kind, path):
+    """Drop a reference. The caller commits; the last one deletes the path afterwards.
+
+    Paths stored before reference counting existed have no row and are left alone.
+    """
+    if not path:
+        return
+    db.session.execute(update(StoredObject).where(StoredObject.kind == kind, StoredObject.path == path)
+                       .values(refcount=StoredObject.refcount - 1))
+    deleted = StoredObject.query.filter(StoredObject.kind == kind, StoredObject.path == path,
+                                        StoredObject.refcount <= 0).delete()
+    if deleted:
+        _orphans(db.session).add((kind, path))
+
+
+def _orphans(session):
+    return session.info.setdefault('storage_orphans', set())
+
+
+@event.listens_for(Session, 'after_commit')
+def _remove_orphans(session):
+    for kind, path in session.info.pop('storage_orphans', ()):
+        full_path = os.path.join(_folders[kind], path)
+        if os.path.isdir(full_path):
+            shutil.rmtree(full_path, ignore_errors=True)
+        elif os.path.exists(full_path):
+            os.remove(full_path)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_orphans(session):
+    session.info.pop('storage_orphans', None)
@@ -0,0 +1,330 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Durable background queue for the transcoding pipeline.
+
+Uploads only write a `TranscodeJob` row. A `TranscodeWorker` polls the
+table, claims queued jobs and runs `media.process_upload` in a bounded
+process pool, so at most `TRANSCODE_WORKERS` ffmpeg pipelines run at the
+same time no matter how many uploads pile up. A claimed job holds a lease
+of `TRANSCODE_LEASE_SECONDS` that its worker keeps renewing; when a worker
+dies, any other worker queues its jobs again once their lease runs out.
+
+Output directories are named after the source digest (see storage.py). A
+source that already has a ready video is not transcoded again: the new
+video shares its renditions and, unless it has its own poster, its images.
+
+Jobs with a `quality` encode one missing rung of an on-demand video from
+its mezzanine, see renditions.py.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+import analytics
+import cache
+import media
+import metrics
+import recommendations
+import renditions
+import search
+import storage
+from models import db, CachedRendition, MediaInfo, Video, VideoRendition, TranscodeJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_transcode(video, source_path, thumbnail_path=None, poster_digest=None):
+    """Add a job for `video` to the current session. The caller commits."""
+    images_digest = storage.combine(video.source_digest, poster_digest) if poster_digest else video.source_digest
+    job = TranscodeJob(
+        video_id=video.video_id,
+        source_path=source_path,
+        base_filename=storage.shard_path(video.source_digest),
+        thumbnail_dir=storage.shard_path(images_digest),
+        thumbnail_path=thumbnail_path,
+    )
+    db.session.add(job)
+    return job
+
+
+def _ready_duplicate(job):
+    """A ready video of the same source, preferably one that also has the same images."""
+    video = job.video
+    return Video.query.filter(
+        Video.source_digest == video.source_digest,
+        Video.status == Video.STATUS_READY,
+        Video.id != video.id,
+    ).order_by((Video.thumbnail_dir == job.thumbnail_dir).desc(), Video.id).first()
+
+
+def _remove_sources(job):
+    for path in (job.source_path, job.thumbnail_path):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+class TranscodeWorker:
+    """Feeds queued jobs from the database into a local process pool."""
+
+    def __init__(self, app, max_workers=None, poll_interval=None, max_attempts=None):
+        self.app = app
+        self.max_workers = max_workers or app.config['TRANSCODE_WORKERS']
+        self.poll_interval = poll_interval or app.config['TRANSCODE_POLL_INTERVAL']
+        self.max_attempts = max_attempts or app.config['TRANSCODE_MAX_ATTEMPTS']
+        self.lease_seconds = app.config['TRANSCODE_LEASE_SECONDS']
+        self._stop = threading.Event()
+        self._thread = None
+        self._in_flight = {}
+        self._next_renewal = 0
+
+    def start(self):
+        """Run the dispatcher loop in a daemon thread."""
+        self._thread = threading.Thread(target=self.run, name='transcode-worker', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run(self):
+        with self.app.app_context():
+            # Spawned children do not inherit the metrics configuration
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=metrics.configure,
+                                     initargs=(self.app.config['METRICS_FOLDER'],
+                                               self.app.config['METRICS_FLUSH_SECONDS'])) as pool:
+                while not self._stop.is_set():
+                    try:
+                        claimed = self._dispatch(pool)
+                    except Exception:
+                        # A job left running is requeued when its lease runs out
+                        logger.exception('Transcode dispatch failed')
+                        db.session.rollback()
+                        claimed = False
+                    if not claimed:
+                        self._stop.wait(self.poll_interval)
+                # Let running transcodes finish so their results are recorded
+                while self._in_flight:
+                    time.sleep(self.poll_interval)
+                    try:
+                        self._renew_leases()
+                        self._collect_finished()
+                    except Exception:
+                        logger.exception('Transcode dispatch failed')
+                        db.session.rollback()
+
+    def _dispatch(self, pool):
+        """Record finished jobs and start queued ones while there are free slots. Returns whether any was claimed."""
+        self._renew_leases()
+        self._collect_finished()
+        claimed = False
+        while len(self._in_flight) < self.max_workers:
+            job = self._claim_next()
+            if job is None:
+                break
+            claimed = True
+            if job.quality:
+                future = pool.submit(
+                    media.encode_rendition,
+                    self.app.config['UPLOAD_FOLDER'],
+                    job.base_filename,
+                    job.quality,
+                    self.app.config['TRANSCODE_THREADS'],
+                    self.app.config['TRANSCODE_PRESETS'],
+                    self.app.config['HLS_SEGMENT_SECONDS'],
+                )
+                self._in_flight[future] = (job.id, None)
+                continue
+            original = _ready_duplicate(job)
+            if original is not None and original.thumbnail_dir == job.thumbnail_dir:
+                # Same source and poster: nothing to run
+                media_info = original.media_info.to_dict() if original.media_info else None
+                self._finish(job.id, partial(self._complete, result={
+                    'duration': original.duration, 'master': None, 'renditions': [], 'stats': None,
+                    'images': job.thumbnail_dir, 'media_info': media_info}, original=original))
+                continue
+            future = pool.submit(
+                media.process_upload,
+                job.source_path,
+                self.app.config['UPLOAD_FOLDER'],
+                job.base_filename,
+                self.app.config['THUMBNAIL_FOLDER'],
+                job.thumbnail_dir,
+                job.thumbnail_path,
+                self.app.config['TRANSCODE_THREADS'],
+                self.app.config['TRANSCODE_PRESETS'],
+                self.app.config['HLS_SEGMENT_SECONDS'],
+                transcode=original is None,
+                default_quality=self.app.config['TRANSCODE_DEFAULT_QUALITY']
+                if self.app.config['TRANSCODE_MODE'] == 'on_demand' else None,
+            )
+            self._in_flight[future] = (job.id, original.id if original is not None else None)
+        return claimed
+
+    def requeue_stale(self):
+        """Put running jobs whose lease ran out, because their worker died, back in the queue.
+
+        Jobs that have used up their attempts fail instead, so a job that
+        keeps killing its worker is not run forever.
+        """
+        expired = (
+            TranscodeJob.status == TranscodeJob.STATUS_RUNNING,
+            func.coalesce(TranscodeJob.heartbeat_at, TranscodeJob.started_at)
+            < datetime.now() - timedelta(seconds=self.lease_seconds),
+        )
+        failed = []
+        for job_id in db.session.scalars(db.select(TranscodeJob.id).where(
+                *expired, TranscodeJob.attempts >= self.max_attempts)).all():
+            # Conditional like the claim, another worker may be expiring it too
+            if TranscodeJob.query.filter(TranscodeJob.id == job_id, *expired).update(
+                    {'status': TranscodeJob.STATUS_FAILED}, synchronize_session=False):
+                job = db.session.get(TranscodeJob, job_id, populate_existing=True)
+                logger.error('Transcode job %s failed: its worker stopped', job_id)
+                job.error = 'The worker running this job stopped.'
+                self._mark_failed(job)
+                failed.append(job)
+        TranscodeJob.query.filter(*expired).update({'status': TranscodeJob.STATUS_QUEUED},
+                                                   synchronize_session=False)
+        db.session.commit()
+        for job in failed:
+            if not job.quality:
+                _remove_sources(job)
+
+    def _renew_leases(self):
+        """Every quarter lease, renew the jobs running here and requeue those of dead workers."""
+        now = time.monotonic()
+        if now < self._next_renewal:
+            return
+        self._next_renewal = now + self.lease_seconds / 4
+        job_ids = [job_id for job_id, _ in self._in_flight.values()]
+        if job_ids:
+            TranscodeJob.query.filter(TranscodeJob.id.in_(job_ids)).update(
+                {'heartbeat_at': datetime.now()}, synchronize_session=False)
+            db.session.commit()
+        self.requeue_stale()
+
+    def _claim_next(self):
+        while True:
+            # Never run two jobs writing to the same output directory at once
+            running = db.session.query(TranscodeJob.base_filename).filter_by(status=TranscodeJob.STATUS_RUNNING)
+            job = TranscodeJob.query.filter_by(status=TranscodeJob.STATUS_QUEUED) \
+                .filter(TranscodeJob.base_filename.not_in(running.scalar_subquery())) \
+                .order_by(TranscodeJob.id).first()
+            if job is None:
+                return None
+            # Conditional update so two workers never pick up the same job
+            claimed = TranscodeJob.query.filter_by(id=job.id, status=TranscodeJob.STATUS_QUEUED).update({
+                'status': TranscodeJob.STATUS_RUNNING,
+                'started_at': datetime.now(),
+                'heartbeat_at': datetime.now(),
+                'attempts': TranscodeJob.attempts + 1,
+            })
+            db.session.commit()
+            if claimed:
+                return db.session.get(TranscodeJob, job.id)
+
+    def _collect_finished(self):
+        for future in [f for f in self._in_flight if f.done()]:
+            job_id, original_id = self._in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                self._finish(job_id, partial(self._fail, error=e))
+            else:
+                self._finish(job_id, partial(self._record_result, result=result, original_id=original_id))
+
+    def _finish(self, job_id, record):
+        """Store the outcome of a job with `record(job)` and commit; a job whose outcome can't be stored fails."""
+        job = db.session.get(TranscodeJob, job_id)
+        try:
+            record(job)
+            db.session.commit()
+        except Exception as e:
+            logger.exception('Recording the outcome of transcode job %s failed', job_id)
+            db.session.rollback()
+            job = db.session.get(TranscodeJob, job_id)
+            self._fail(job, e)
+            db.session.commit()
+        if job.quality:
+            renditions.evict()
+        elif job.status in (TranscodeJob.STATUS_DONE, TranscodeJob.STATUS_FAILED):
+            # Only once the outcome is committed, so a retry still has them
+            _remove_sources(job)
+
+    def _record_result(self, job, result, original_id):
+        if job.quality:
+            self._complete_rendition(job, result)
+        else:
+            self._complete(job, result, db.session.get(Video, original_id) if original_id else None)
+
+    def _complete(self, job, result, original=None):
+        """Publish the video. `original` is the ready video whose renditions are reused, if any."""
+        video = job.video
+        if original is not None:
+            video.hls_playlist = original.hls_playlist
+            renditions = [{column: getattr(rendition, column)
+                           for column in ('quality', 'width', 'height', 'codec', 'bitrate', 'size', 'path')}
+                          for rendition in original.renditions]
+        else:
+            video.hls_playlist = result['master']
+            renditions = result['renditions']
+        video.renditions = [VideoRendition(**rendition) for rendition in renditions]
+        storage.acquire('renditions', job.base_filename)
+        storage.acquire('images', job.thumbnail_dir)
+        video.duration = str(result['duration'])
+        if result['media_info']:
+            db.session.merge(MediaInfo(video_id=video.video_id, **result['media_info']))
+        video.thumbnail_dir = result['images']
+        video.thumbnail_filename = f"{result['images']}/{media.THUMBNAIL_FALLBACK_WIDTH}.jpg"
+        video.status = Video.STATUS_READY
+        analytics.record_upload(video.user_id)
+        search.index_video(video)
+        # The channel's other videos get a new same-uploader candidate
+        recommendations.mark_channel_stale(video.user_id)
+        cache.invalidate(f'channel:{video.user_id}', f'uploads:{video.user_id}')
+        job.status = TranscodeJob.STATUS_DONE
+        job.error = None
+        job.stats = json.dumps(result['stats']) if result['stats'] else None
+        job.finished_at = datetime.now()
+        recommendations.refresh(video)
+
+    def _complete_rendition(self, job, result):
+        rendition = result['rendition']
+        VideoRendition.query.filter_by(path=rendition['path']).update({'size': rendition['size']})
+        entry = db.session.get(CachedRendition, (job.base_filename, job.quality))
+        entry.status = CachedRendition.STATUS_READY
+        entry.size = rendition['size']
+        entry.last_used_at = datetime.now()
+        job.status = TranscodeJob.STATUS_DONE
+        job.error = None
+        job.stats = json.dumps(result['stats'])
+        job.finished_at = datetime.now()
+
+    def _fail(self, job, error):
+        logger.error('Transcode job %s failed: %s', job.id, error)
+        job.error = str(error)
+        if job.attempts < self.max_attempts:
+            job.status = TranscodeJob.STATUS_QUEUED
+            return
+        self._mark_failed(job)
+
+    def _mark_failed(self, job):
+        job.status = TranscodeJob.STATUS_FAILED
+        job.finished_at = datetime.now()
+        if job.quality:
+            # The video stays playable at its other rungs; the mezzanine is kept
+            db.session.get(CachedRendition, (job.base_filename, job.quality)).status = CachedRendition.STATUS_FAILED
+            return
+        job.video.status = Video.STATUS_FAILED
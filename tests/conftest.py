@@ -0,0 +1,44 @@
+import os
+import tempfile
+
+import pytest
+
+_folder = tempfile.mkdtemp(prefix='owu-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_folder, 'test.db')
+
+import app as owu  # noqa: E402
+import cache  # noqa: E402
+import recommendations  # noqa: E402
+from models import db, User, Video  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    owu.app.config.update(TESTING=True, SECRET_KEY='test', WTF_CSRF_ENABLED=False, PASSWORD_HASH_WORKERS=0,
+                          METRICS_FOLDER=os.path.join(_folder, 'metrics'))
+    owu.limiter.enabled = False
+    for fragments in (cache.fragment_cache, cache.user_cache, cache.feed_cache):
+        fragments.clear()
+    recommendations._popular['expires'] = 0
+    with owu.app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield owu.app
+        db.session.remove()
+
+
+@pytest.fixture
+def users(app):
+    accounts = [User(username=f'user{i}', email=f'user{i}@example.com', password_hash='x', channel_name=f'user{i}')
+                for i in range(3)]
+    db.session.add_all(accounts)
+    db.session.commit()
+    return accounts
+
+
+@pytest.fixture
+def video(users):
+    video = Video(video_id='v1', title='t', thumbnail_filename='t.jpg', user_id=users[1].id)
+    db.session.add(video)
+    db.session.commit()
+    return video
@@ -0,0 +1,15 @@
+import analytics
+from models import db
+
+
+def test_channel_header_follows_totals(app, users, video):
+    client = app.test_client()
+    channel = users[1]
+    assert '0 подписчиков' in client.get(f'/channel/{channel.id}').get_data(as_text=True)
+
+    users[0].subscribe(channel)
+    analytics.record_views({video.video_id: 7})
+    db.session.commit()
+    header = client.get(f'/channel/{channel.id}').get_data(as_text=True)
+    assert '1 подписчиков' in header
+    assert '7 просмотров' in header
@@ -0,0 +1,56 @@
+import ipaddress
+import os
+
+import pytest
+
+from blocklist import Blocklist, PrefixTrie
+
+
+def trie(*networks):
+    prefixes = PrefixTrie()
+    for network in networks:
+        prefixes.add(ipaddress.ip_network(network))
+    return prefixes
+
+
+@pytest.mark.parametrize('networks, address, blocked', [
+    (['10.0.0.0/8'], '10.255.1.2', True),
+    (['10.0.0.0/8'], '11.0.0.1', False),
+    (['192.0.2.7/32'], '192.0.2.7', True),
+    (['192.0.2.7/32'], '192.0.2.6', False),
+    (['0.0.0.0/0'], '203.0.113.9', True),
+    (['0.0.0.0/0'], '2001:db8::1', False),
+    (['2001:db8::/32'], '2001:db8:ffff::1', True),
+    (['2001:db8::/32'], '2001:db9::1', False),
+    (['::/0'], '2001:db8::1', True),
+    (['2001:db8::1/128'], '2001:db8::1', True),
+    (['2001:db8::1/128'], '2001:db8::2', False),
+    (['192.0.2.7/32', '192.0.2.0/24'], '192.0.2.200', True),
+    (['192.0.2.0/24', '192.0.2.7/32'], '192.0.2.200', True),
+])
+def test_prefix_trie(networks, address, blocked):
+    assert (ipaddress.ip_address(address) in trie(*networks)) is blocked
+
+
+def test_blocklist_matches_ipv4_mapped_addresses():
+    blocklist = Blocklist(['198.51.100.0/24'])
+    blocklist.reload()
+    assert blocklist.is_blocked('::ffff:198.51.100.1')
+    assert not blocklist.is_blocked('not an address')
+
+
+def test_blocklist_reloads_a_changed_file(tmp_path):
+    path = tmp_path / 'blocklist.txt'
+    path.write_text('192.0.2.0/24  # test range\n')
+    blocklist = Blocklist(path=str(path), reload_seconds=0)
+    assert blocklist.is_blocked('192.0.2.1')
+    assert not blocklist.is_blocked('198.51.100.1')
+
+    path.write_text('198.51.100.0/24\n')
+    mtime = os.stat(path).st_mtime_ns + 1_000_000_000
+    os.utime(path, ns=(mtime, mtime))
+    assert not blocklist.is_blocked('192.0.2.1')
+    assert blocklist.is_blocked('198.51.100.1')
+
+    os.remove(path)
+    assert not blocklist.is_blocked('198.51.100.1')
@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy import insert
+
+import analytics
+import models
+from database import insert_ignore
+from models import db, Like, Subscription, User, Video
+
+
+def subscriber_count(user):
+    return db.session.query(User.subscriber_count).filter_by(id=user.id).scalar()
+
+
+def test_duplicate_subscribe_keeps_counter(users):
+    subscriber, channel = users[0], users[1]
+    assert subscriber.subscribe(channel)
+    assert not subscriber.subscribe(channel)
+    assert Subscription.query.filter_by(subscribed_to_id=channel.id).count() == 1
+    assert subscriber_count(channel) == 1
+
+
+def test_failed_subscribe_leaves_no_row(users, monkeypatch):
+    subscriber, channel = users[0], users[1]
+
+    def fail(*args):
+        raise RuntimeError('between the insert and the counter')
+
+    monkeypatch.setattr(analytics, 'record_subscription', fail)
+    with pytest.raises(RuntimeError):
+        subscriber.subscribe(channel)
+    db.session.rollback()
+    assert Subscription.query.count() == 0
+    assert subscriber_count(channel) == 0
+
+
+def test_duplicate_like_keeps_counter(users, video, monkeypatch):
+    def racing_insert(session, model, **values):
+        # A concurrent request adds the same like right before this one
+        session.execute(insert(model).values(**values))
+        return insert_ignore(session, model, **values)
+
+    monkeypatch.setattr(models, 'insert_ignore', racing_insert)
+    assert users[0].toggle_like(video)
+    assert Like.query.filter_by(video_id=video.video_id).count() == 1
+    assert db.session.query(Video.likes).filter_by(id=video.id).scalar() == 0
+
+
+def test_failed_like_leaves_no_row(users, video, monkeypatch):
+    def fail(*args):
+        raise RuntimeError('between the insert and the counter')
+
+    monkeypatch.setattr(analytics, 'record_like', fail)
+    with pytest.raises(RuntimeError):
+        users[0].toggle_like(video)
+    db.session.rollback()
+    assert Like.query.count() == 0
+    assert db.session.query(Video.likes).filter_by(id=video.id).scalar() == 0
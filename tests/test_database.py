@@ -0,0 +1,85 @@
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+
+import database
+from database import REPLICA, RoutingSession, insert_ignore, read_replica
+from models import db, Subscription
+
+replicated = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+class Item(replicated.Model):
+    id = replicated.Column(replicated.Integer, primary_key=True)
+    name = replicated.Column(replicated.String(20), nullable=False)
+
+
+def make_app(tmp_path, replica=False):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'primary.db'}",
+                      SQLITE_BUSY_TIMEOUT=1234, SQLITE_MMAP_SIZE=0,
+                      DATABASE_REPLICA_URL=f"sqlite:///{tmp_path / 'replica.db'}" if replica else None)
+    database.configure(app)
+    replicated.init_app(app)
+    database.init_app(app)
+    return app
+
+
+def test_pragmas_apply_to_every_connection(tmp_path):
+    app = make_app(tmp_path)
+    with app.app_context():
+        engine = replicated.engine
+        # Both checked out at once, so they are two connections
+        with engine.connect() as first, engine.connect() as second:
+            for connection in (first, second):
+                assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+                assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 1234
+                assert connection.exec_driver_sql('PRAGMA foreign_keys').scalar() == 1
+
+
+def test_insert_ignore_skips_duplicates(app, users):
+    assert insert_ignore(db.session, Subscription, subscriber_id=users[0].id, subscribed_to_id=users[1].id)
+    assert not insert_ignore(db.session, Subscription, subscriber_id=users[0].id, subscribed_to_id=users[1].id)
+    db.session.commit()
+    assert Subscription.query.count() == 1
+
+
+@pytest.fixture
+def replicated_app(tmp_path):
+    app = make_app(tmp_path, replica=True)
+    with app.app_context():
+        for bind_key, name in ((None, 'primary'), (REPLICA, 'replica')):
+            engine = replicated.engines[bind_key]
+            replicated.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(Item.__table__.insert().values(name=name))
+    return app
+
+
+@read_replica
+def item_names():
+    names = [item.name for item in Item.query.order_by(Item.id)]
+    return names, replicated.session.execute(text('SELECT name FROM item ORDER BY id')).scalars().all()
+
+
+def test_read_replica_serves_selects_of_get_requests(replicated_app):
+    with replicated_app.test_request_context('/'):
+        assert item_names() == (['replica'], ['replica'])
+    with replicated_app.test_request_context('/', method='POST'):
+        assert item_names() == (['primary'], ['primary'])
+    with replicated_app.test_request_context('/'):
+        assert [item.name for item in Item.query] == ['primary']
+
+
+def test_read_replica_keeps_writes_on_the_primary(replicated_app):
+    with replicated_app.test_request_context('/'):
+        item_names()
+        replicated.session.add(Item(name='added'))
+        replicated.session.flush()
+        replicated.session.execute(text("UPDATE item SET name = 'updated' WHERE name = 'primary'"))
+        replicated.session.commit()
+    with replicated_app.app_context():
+        assert [item.name for item in Item.query.order_by(Item.id)] == ['updated', 'added']
+        with replicated.engines[REPLICA].connect() as connection:
+            assert connection.execute(text('SELECT name FROM item')).scalars().all() == ['replica']
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def media_dir(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    directory = tmp_path / 'ab' / 'cd'
+    directory.mkdir(parents=True)
+    (directory / 'master.m3u8').write_text('#EXTM3U\n')
+    (directory / 'mezzanine').write_bytes(b'source video')
+    return directory
+
+
+def test_media_folders_are_not_static(app):
+    static = os.path.abspath(app.static_folder) + os.sep
+    for folder in ('UPLOAD_FOLDER', 'UPLOAD_SESSION_FOLDER'):
+        assert not os.path.abspath(app.config[folder]).startswith(static)
+
+
+def test_mezzanine_is_not_served(app, media_dir):
+    client = app.test_client()
+    assert client.get('/media/ab/cd/master.m3u8').status_code == 200
+    assert client.get('/media/ab/cd/mezzanine').status_code == 404
+
+
+@pytest.mark.parametrize('range_header', [None, 'bytes=0-', 'bytes=2-5', 'bytes=0-1,4-6'])
+def test_head_matches_get(app, media_dir, range_header):
+    (media_dir / '720p_00000.m4s').write_bytes(bytes(range(100)))
+    client = app.test_client()
+    headers = {'Range': range_header} if range_header else {}
+    get = client.get('/media/ab/cd/720p_00000.m4s', headers=headers)
+    head = client.head('/media/ab/cd/720p_00000.m4s', headers=headers)
+    assert head.status_code == get.status_code
+    assert head.headers['Content-Length'] == get.headers['Content-Length'] == str(len(get.data))
+    assert head.mimetype == get.mimetype
+    assert head.data == b''
+
+
+@pytest.mark.parametrize('on_demand, filename, immutable', [
+    (False, '720p_00000.m4s', True),
+    (False, '720p_init.mp4', True),
+    (False, '720p.m3u8', False),
+    (False, 'master.m3u8', False),
+    (True, '720p_00000.m4s', False),
+    (True, '720p.m3u8', False),
+])
+def test_only_materialized_segments_are_immutable(app, media_dir, on_demand, filename, immutable):
+    if not on_demand:
+        (media_dir / 'mezzanine').unlink()
+    (media_dir / filename).write_bytes(b'data')
+    response = app.test_client().get(f'/media/ab/cd/{filename}')
+    assert response.status_code == 200
+    assert response.cache_control.immutable is immutable
+    if not immutable:
+        assert response.cache_control.must_revalidate
+        assert response.cache_control.max_age <= 60
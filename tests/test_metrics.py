@@ -0,0 +1,66 @@
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import metrics
+from processes import pid_alive
+
+
+def write(folder, name, count):
+    with open(os.path.join(folder, name), 'w') as f:
+        json.dump([['owu_http_requests_total', [['endpoint', 'home']], count]], f)
+
+
+def requests_total(registry):
+    return registry.collect().get(('owu_http_requests_total', (('endpoint', 'home'),)), 0)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'pid_alive', lambda pid: pid != 999999)
+    registry = metrics.Registry()
+    registry.folder = str(tmp_path)
+    return registry
+
+
+def test_compact_archives_exited_processes(registry, tmp_path):
+    write(tmp_path, '999999-1.json', 3)
+    write(tmp_path, '999999.json', 2)
+    write(tmp_path, f'{os.getpid()}-1.json', 5)
+    assert registry.compact() == 2
+    assert sorted(os.listdir(tmp_path)) == sorted([metrics.ARCHIVE, 'archive.lock', f'{os.getpid()}-1.json'])
+    assert requests_total(registry) == 10
+
+    write(tmp_path, '999999-2.json', 1)
+    assert registry.compact() == 1
+    assert requests_total(registry) == 11
+
+
+def test_reused_pid_gets_its_own_file(registry, tmp_path):
+    write(tmp_path, f'{os.getpid()}.json', 4)
+    registry.inc('owu_http_requests_total', endpoint='home')
+    registry.maybe_flush(force=True)
+    assert len(os.listdir(tmp_path)) == 2
+    assert requests_total(registry) == 5
+
+
+def test_spawned_pool_children_record_metrics(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=metrics.configure,
+                             initargs=(str(tmp_path), 5.0)) as pool:
+        pool.submit(metrics.record_subprocess, 'ffmpeg', 'hls', 0, 1.5).result()
+    [name] = os.listdir(tmp_path)
+    with open(tmp_path / name) as f:
+        assert f.read().startswith('[["owu_subprocess_seconds"')
+
+
+def test_pid_alive():
+    assert pid_alive(os.getpid())
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    assert not pid_alive(child.pid)
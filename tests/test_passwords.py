@@ -0,0 +1,23 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+import passwords
+
+
+@pytest.mark.parametrize('configured, stored, expected', [
+    ('scrypt:32768:8:1', 'scrypt:32768:8:1', False),
+    ('scrypt', 'scrypt:32768:8:1', False),
+    ('scrypt:32768:8:1', 'scrypt', False),
+    ('scrypt:65536:8:1', 'scrypt:32768:8:1', True),
+    ('pbkdf2', 'pbkdf2:sha256', False),
+    ('pbkdf2:SHA256:600000', 'pbkdf2:sha256:600000', False),
+    ('pbkdf2:sha256:1000000', 'pbkdf2:sha256:600000', True),
+    ('scrypt:32768:8:1', 'pbkdf2:sha256:600000', True),
+])
+def test_needs_rehash_compares_parameters(app, monkeypatch, configured, stored, expected):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', configured)
+    assert passwords.needs_rehash(generate_password_hash('secret', stored)) is expected
+
+
+def test_needs_rehash_of_unreadable_hash(app):
+    assert passwords.needs_rehash('scrypt:lots$salt$hash')
@@ -0,0 +1,87 @@
+import contextvars
+from datetime import datetime, timedelta
+
+import pytest
+from flask import request_finished
+
+import analytics
+import recommendations
+import search
+from loaders import query_count
+from models import db, Like, Recommendation, Subscription, Video, VideoRendition
+
+PAGES = {
+    'home': '/',
+    'feed_api': '/api/feed',
+    'search_api': '/api/search?query=video',
+    'view_video': '/video/v00',
+    'view_channel': '/channel/{channel}',
+    'liked_videos': '/liked_videos',
+}
+
+
+@pytest.fixture
+def seeded(app, users):
+    viewer, channel, other = users
+    videos = []
+    for i in range(30):
+        video = Video(video_id=f'v{i:02}', title=f'video {i}', description='about a video', views=i,
+                      thumbnail_filename=f'{i}.jpg', hls_playlist=f'v{i:02}/master.m3u8',
+                      user_id=(channel if i % 2 else other).id, status=Video.STATUS_READY,
+                      created_at=datetime.now() - timedelta(hours=i))
+        video.renditions = [VideoRendition(quality=quality, width=width, height=height, path=f'v{i:02}/{quality}.m3u8')
+                            for quality, width, height in (('720p', 1280, 720), ('360p', 640, 360))]
+        videos.append(video)
+    db.session.add_all(videos)
+    db.session.add_all(Like(user_id=user.id, video_id=video.video_id) for user in users for video in videos[:10])
+    db.session.add_all([Subscription(subscriber_id=viewer.id, subscribed_to_id=channel.id),
+                        Subscription(subscriber_id=other.id, subscribed_to_id=channel.id)])
+    db.session.commit()
+    search.rebuild()
+    analytics.rebuild()
+    recommendations.refresh_stale()
+    return viewer, channel
+
+
+@pytest.fixture
+def client(app, seeded):
+    viewer, _ = seeded
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(viewer.id)
+        session['_fresh'] = True
+    return client
+
+
+def count_queries(app, client, url):
+    counts = []
+
+    def record(sender, response, **extra):
+        counts.append(query_count())
+
+    with request_finished.connected_to(record, app):
+        # Outside the fixture's app context, so the request gets an app context and `g` of its own
+        response = contextvars.Context().run(client.get, url)
+    assert response.status_code == 200
+    return counts[0]
+
+
+@pytest.mark.parametrize('endpoint', sorted(PAGES))
+def test_query_budget(app, client, seeded, endpoint):
+    url = PAGES[endpoint].format(channel=seeded[1].id)
+    budget = app.config['QUERY_BUDGETS'][endpoint]
+    # Cold fragment caches first, then the cached render
+    for _ in range(2):
+        count = count_queries(app, client, url)
+        assert count <= budget, f'{endpoint} ran {count} SQL queries, budget is {budget}'
+
+
+def test_view_video_without_suggestions_stays_in_budget(app, client, monkeypatch):
+    # As for a video uploaded before the recommendation index was backfilled
+    Recommendation.query.filter_by(video_id='v01').delete()
+    Video.query.filter_by(video_id='v01').update({'recommendations_updated_at': None})
+    db.session.commit()
+    scheduled = []
+    monkeypatch.setattr(recommendations, 'schedule_refresh', lambda video: scheduled.append(video.video_id))
+    assert count_queries(app, client, '/video/v01') <= app.config['QUERY_BUDGETS']['view_video']
+    assert scheduled == ['v01']
@@ -0,0 +1,37 @@
+import time
+
+import pytest
+from limits.storage import MemoryStorage
+
+from ratelimit import SQLiteStorage
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    return now
+
+
+def test_counters_are_shared_and_expire(tmp_path, clock):
+    uri = f"sqlite:///{tmp_path / 'limits.db'}"
+    first, second = SQLiteStorage(uri), SQLiteStorage(uri)
+    assert first.incr('client', 10) == 1
+    assert second.incr('client', 10) == 2
+    assert first.get('client') == 2
+    assert second.get_expiry('client') == 1010.0
+    clock[0] = 1010.0
+    assert first.get('client') == 0
+    assert second.incr('client', 10) == 1
+    assert first.get_expiry('client') == 1020.0
+
+
+def test_sliding_window_matches_memory_storage(tmp_path, clock):
+    sqlite_storage = SQLiteStorage(f"sqlite:///{tmp_path / 'limits.db'}")
+    memory_storage = MemoryStorage()
+    for now in (1000, 1001, 1003, 1004, 1009, 1012, 1013, 1015, 1016, 1019, 1021, 1024, 1035, 1055):
+        clock[0] = float(now)
+        acquired = sqlite_storage.acquire_sliding_window_entry('client', 3, 10)
+        assert acquired == memory_storage.acquire_sliding_window_entry('client', 3, 10), now
+        assert sqlite_storage.get_sliding_window('client', 10) == \
+            pytest.approx(memory_storage.get_sliding_window('client', 10)), now
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+
+import recommendations
+from models import db, Video
+
+
+def test_channel_events_make_its_lists_stale(app, video):
+    refreshed_at = datetime.now() - timedelta(seconds=app.config['RECOMMENDATION_REFRESH_SECONDS'] + 1)
+    video.recommendations_stale = False
+    video.recommendations_updated_at = refreshed_at
+    db.session.commit()
+    assert not recommendations._due(video)
+    assert recommendations.refresh_stale() == 0
+
+    recommendations.mark_channel_stale(video.user_id)
+    db.session.commit()
+    db.session.expire_all()
+    video = db.session.get(Video, video.id)
+    assert recommendations._due(video)
+    assert recommendations.refresh_stale() == 1
+    assert not recommendations._due(video)
+
+
+def test_background_refresh_logs_errors(app, video, monkeypatch, caplog):
+    def refresh(video):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(recommendations, 'refresh', refresh)
+    recommendations._scheduled.add(video.video_id)
+    recommendations._refresh_in_background(app, video.video_id)
+    assert 'database is locked' in caplog.text
+    assert video.video_id not in recommendations._scheduled
@@ -0,0 +1,70 @@
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from models import db, TranscodeJob, Video
+from tasks import TranscodeWorker
+
+
+def running_job(video, heartbeat_at, attempts=1, source_path='source'):
+    job = TranscodeJob(video_id=video.video_id, source_path=source_path, base_filename='out', thumbnail_dir='out',
+                       status=TranscodeJob.STATUS_RUNNING, started_at=heartbeat_at, heartbeat_at=heartbeat_at,
+                       attempts=attempts)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def test_requeue_stale_keeps_live_leases(app, video):
+    live = running_job(video, datetime.now())
+    expired = running_job(video, datetime.now() - timedelta(seconds=app.config['TRANSCODE_LEASE_SECONDS'] + 1))
+    TranscodeWorker(app).requeue_stale()
+    assert db.session.get(TranscodeJob, live).status == TranscodeJob.STATUS_RUNNING
+    assert db.session.get(TranscodeJob, expired).status == TranscodeJob.STATUS_QUEUED
+
+
+def test_worker_survives_dispatch_errors(app, monkeypatch):
+    worker = TranscodeWorker(app, poll_interval=0.01)
+    calls = []
+
+    def dispatch(pool):
+        calls.append(pool)
+        if len(calls) == 1:
+            raise RuntimeError('database is locked')
+        worker._stop.set()
+        return False
+
+    monkeypatch.setattr(worker, '_dispatch', dispatch)
+    worker.run()
+    assert len(calls) == 2
+
+
+def test_requeue_stale_fails_jobs_out_of_attempts(app, video, tmp_path):
+    source = tmp_path / 'source'
+    source.write_bytes(b'video')
+    expired = datetime.now() - timedelta(seconds=app.config['TRANSCODE_LEASE_SECONDS'] + 1)
+    job_id = running_job(video, expired, attempts=app.config['TRANSCODE_MAX_ATTEMPTS'], source_path=str(source))
+    TranscodeWorker(app).requeue_stale()
+    assert db.session.get(TranscodeJob, job_id).status == TranscodeJob.STATUS_FAILED
+    assert db.session.get(Video, video.id).status == Video.STATUS_FAILED
+    assert not source.exists()
+
+
+def test_completion_errors_fail_the_job(app, video, tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    source.write_bytes(b'video')
+    job_id = running_job(video, datetime.now(), attempts=app.config['TRANSCODE_MAX_ATTEMPTS'],
+                         source_path=str(source))
+    worker = TranscodeWorker(app)
+
+    def complete(job, result, original=None):
+        raise KeyError('master')
+
+    monkeypatch.setattr(worker, '_complete', complete)
+    future = Future()
+    future.set_result({})
+    worker._in_flight[future] = (job_id, None)
+    worker._collect_finished()
+    job = db.session.get(TranscodeJob, job_id)
+    assert job.status == TranscodeJob.STATUS_FAILED
+    assert 'master' in job.error
+    assert not source.exists()
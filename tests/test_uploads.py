@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+import uploads
+from models import db, UploadSession
+
+
+@pytest.fixture
+def session(app, users, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_SESSION_FOLDER', str(tmp_path))
+    session = uploads.create_session(users[0], 'clip.mp4', 10, 'clip', '')
+    uploads.write_chunk(session, 0, b'0123456789')
+    return session.id
+
+
+def test_concurrent_complete_has_one_winner(app, session, monkeypatch):
+    both_checked = threading.Barrier(2)
+    missing_chunks = uploads.missing_chunks
+
+    def racing_missing_chunks(upload):
+        missing = missing_chunks(upload)
+        both_checked.wait(timeout=5)
+        return missing
+
+    monkeypatch.setattr(uploads, 'missing_chunks', racing_missing_chunks)
+    results = []
+
+    def complete():
+        with app.app_context():
+            try:
+                results.append(uploads.complete(db.session.get(UploadSession, session)))
+            except uploads.UploadError as e:
+                results.append(e.status)
+
+    threads = [threading.Thread(target=complete) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 409 in results
+    results.remove(409)
+    [(source_path, digest)] = results
+    with open(source_path, 'rb') as f:
+        assert f.read() == b'0123456789'
+    assert db.session.get(UploadSession, session) is None
@@ -0,0 +1,48 @@
+import os
+
+from models import db, Video
+from processes import pid_alive
+from viewcount import ViewBuffer
+
+
+def test_failed_recovery_still_counts_views(app, video, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'VIEW_LOG_FOLDER', str(tmp_path))
+    monkeypatch.setitem(app.config, 'VIEW_FLUSH_INTERVAL', 3600)
+    buffer = ViewBuffer(app)
+
+    def fail():
+        raise OSError('disk error')
+
+    monkeypatch.setattr(buffer, 'recover', fail)
+    buffer.record(video.video_id)
+    assert buffer._pid == os.getpid()
+    assert not buffer._recovered
+    buffer.flush()
+    db.session.expire_all()
+    assert db.session.query(Video.views).filter_by(id=video.id).scalar() == 1
+
+
+def dead_pid():
+    pid = 2 ** 22 + 1
+    assert not pid_alive(pid)
+    return pid
+
+
+def test_recover_skips_logs_being_replayed(app, video, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'VIEW_LOG_FOLDER', str(tmp_path))
+    monkeypatch.setitem(app.config, 'VIEW_FLUSH_INTERVAL', 3600)
+    replaying = tmp_path / f'views.{dead_pid()}-1.log.recovering.{os.getppid()}-1'
+    replaying.write_text(video.video_id + '\n')
+    orphaned = tmp_path / f'views.{dead_pid()}-2.log.recovering.{dead_pid()}-1'
+    orphaned.write_text(video.video_id + '\n')
+    reused = tmp_path / f'views.{os.getpid()}-1.log'
+    reused.write_text(video.video_id + '\n')
+    buffer = ViewBuffer(app)
+    buffer.record(video.video_id)
+    buffer.flush()
+    db.session.expire_all()
+    assert db.session.query(Video.views).filter_by(id=video.id).scalar() == 3
+    assert replaying.exists()
+    assert not orphaned.exists()
+    assert not reused.exists()
+    assert sorted(os.listdir(tmp_path)) == sorted([replaying.name, f'views.{buffer._name}.log'])
@@ -0,0 +1,140 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Resumable chunked uploads.
+
+A client opens an `UploadSession` with the size of the file, then PUTs it
+in `UPLOAD_CHUNK_SIZE` chunks, in any order and several at a time. Each
+chunk is checked against its expected length and the SHA-256 sent in the
+`X-Chunk-SHA256` header, then written straight to its offset in a
+preallocated file. After a dropped connection the client asks which chunks
+are missing and sends only those. Completing the session hashes the
+assembled file and hands it to the transcoding queue like a regular upload.
+
+Sessions that receive nothing for `UPLOAD_SESSION_TTL` seconds are removed
+together with their data.
+"""
+
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete
+
+from database import insert_ignore
+import storage
+from models import db, UploadSession, UploadChunk
+
+
+class UploadError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _ttl():
+    return timedelta(seconds=current_app.config['UPLOAD_SESSION_TTL'])
+
+
+def part_path(session):
+    return os.path.join(current_app.config['UPLOAD_SESSION_FOLDER'], f'{session.id}.part')
+
+
+def create_session(user, filename, size, title, description):
+    if size <= 0:
+        raise UploadError('File is empty.')
+    if size > current_app.config['UPLOAD_MAX_SIZE']:
+        raise UploadError('File is too large.', 413)
+    expire_sessions()
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        filename=filename,
+        title=title,
+        description=description,
+        size=size,
+        chunk_size=current_app.config['UPLOAD_CHUNK_SIZE'],
+        expires_at=datetime.now() + _ttl(),
+    )
+    os.makedirs(current_app.config['UPLOAD_SESSION_FOLDER'], exist_ok=True)
+    # Preallocate so chunks can be written at their offsets in any order
+    with open(part_path(session), 'wb') as f:
+        f.truncate(size)
+    db.session.add(session)
+    db.session.commit()
+    return session
+
+
+def write_chunk(session, index, data, checksum=None):
+    """Verify one chunk and write it at its offset. Sending a chunk again is a no-op."""
+    if not 0 <= index < session.chunk_count:
+        raise UploadError('Chunk index out of range.', 416)
+    offset = index * session.chunk_size
+    if len(data) != min(session.chunk_size, session.size - offset):
+        raise UploadError('Chunk has the wrong length.')
+    digest = hashlib.sha256(data).hexdigest()
+    if checksum and checksum.lower() != digest:
+        raise UploadError('Chunk checksum mismatch.', 422)
+
+    received = db.session.get(UploadChunk, (session.id, index))
+    if received is not None:
+        if received.sha256 != digest:
+            raise UploadError('Chunk was already received with different content.', 409)
+        return
+
+    with open(part_path(session), 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+    # The same chunk may arrive twice at once
+    insert_ignore(db.session, UploadChunk, session_id=session.id, index=index, sha256=digest)
+    session.expires_at = datetime.now() + _ttl()
+    db.session.commit()
+
+
+def received_chunks(session):
+    return sorted(row[0] for row in db.session.query(UploadChunk.index).filter_by(session_id=session.id))
+
+
+def missing_chunks(session):
+    received = set(received_chunks(session))
+    return [index for index in range(session.chunk_count) if index not in received]
+
+
+def complete(session):
+    """Finish the session. Returns `(source_path, digest)` of the assembled file, now owned by the caller.
+
+    Commits the removal of the session first, so of concurrent calls only one
+    gets the file; the others get a 409.
+    """
+    if missing_chunks(session):
+        raise UploadError('Upload is incomplete.', 409)
+    part = part_path(session)
+    source_path = os.path.join(current_app.config['UPLOAD_SESSION_FOLDER'], f'{session.id}.source')
+    db.session.execute(delete(UploadChunk).where(UploadChunk.session_id == session.id))
+    if not db.session.execute(delete(UploadSession).where(UploadSession.id == session.id)).rowcount:
+        db.session.rollback()
+        raise UploadError('Upload is already being completed.', 409)
+    db.session.commit()
+    os.replace(part, source_path)
+    return source_path, storage.file_digest(source_path)
+
+
+def discard(session):
+    if os.path.exists(part_path(session)):
+        os.remove(part_path(session))
+    db.session.delete(session)
+
+
+def expire_sessions():
+    """Remove sessions nobody has written to for UPLOAD_SESSION_TTL seconds. Returns how many."""
+    expired = UploadSession.query.filter(UploadSession.expires_at < datetime.now()).all()
+    for session in expired:
+        discard(session)
+    db.session.commit()
+    return len(expired)
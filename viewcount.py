@@ -0,0 +1,161 @@
+# Copyright (C) 2025 ZHEEZL
+# All rights reserved.
+# This software is proprietary and may not be used, copied, modified,
+# or distributed without prior written permission from the author.
+
+"""Write-behind buffer for video view counts.
+
+`/update_views` only bumps an in-memory counter and appends the video id to
+a per-process log file. The buffer is flushed to the database as one batched
+`UPDATE video SET views = views + n` per video every `VIEW_FLUSH_INTERVAL`
+seconds or after `VIEW_FLUSH_EVENTS` views, whichever comes first.
+
+If a process dies before flushing, the next process to start replays its log
+(logs are named after the pid and start time of the process that wrote them
+and only replayed once that pid is gone, so a reused pid cannot adopt them). A crash between committing a batch and removing its log can count
+that batch twice; views are allowed to be slightly over, never lost.
+"""
+
+import atexit
+import glob
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import text
+
+import analytics
+from models import db
+from processes import pid_alive
+
+logger = logging.getLogger(__name__)
+
+
+def _owner(name):
+    """The `<pid>-<start>` of the process that wrote or is replaying a log."""
+    if '.recovering.' in name:
+        return name.rsplit('.', 1)[1]
+    return name.split('.')[1]
+
+
+class ViewBuffer:
+
+    def __init__(self, app):
+        self.app = app
+        self.folder = app.config['VIEW_LOG_FOLDER']
+        self.interval = app.config['VIEW_FLUSH_INTERVAL']
+        self.max_events = app.config['VIEW_FLUSH_EVENTS']
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts = Counter()
+        self._events = 0
+        self._log = None
+        self._pending = []
+        self._pid = None
+        self._name = None
+        self._recovered = False
+
+    def _ensure_started(self):
+        """Open this process's log and start the flusher, once per process (safe after fork)."""
+        if self._pid == os.getpid():
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        self._pid = os.getpid()
+        self._name = f'{self._pid}-{time.time_ns()}'
+        try:
+            self._log = open(self._log_path(), 'a', buffering=1, encoding='utf-8')
+        except OSError:
+            self._pid = None
+            raise
+        self._counts = Counter()
+        self._events = 0
+        self._pending = []
+        self._recovered = False
+        threading.Thread(target=self._run, name='view-flusher', daemon=True).start()
+        atexit.register(self.flush)
+        self._recover()
+
+    def _log_path(self, suffix='log'):
+        return os.path.join(self.folder, f'views.{self._name}.{suffix}')
+
+    def record(self, video_id):
+        with self._lock:
+            self._ensure_started()
+            self._log.write(video_id + '\n')
+            self._counts[video_id] += 1
+            self._events += 1
+            full = self._events >= self.max_events
+        if full:
+            self.flush()
+
+    def _recover(self):
+        try:
+            self.recover()
+        except Exception:
+            logger.exception('Replaying view logs failed, retrying in the background')
+        else:
+            self._recovered = True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._recovered:
+                self._recover()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing view counts failed')
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._counts:
+                    return
+                counts, self._counts, self._events = self._counts, Counter(), 0
+                # Start a fresh log; the old one is kept until the batch is committed
+                self._log.close()
+                pending = self._log_path(f'{time.time_ns()}.pending')
+                os.replace(self._log_path(), pending)
+                self._pending.append(pending)
+                self._log = open(self._log_path(), 'a', buffering=1, encoding='utf-8')
+            try:
+                self._apply(counts)
+            except Exception:
+                # Retry with the next flush, the pending logs still cover these increments
+                with self._lock:
+                    self._counts.update(counts)
+                raise
+            for path in self._pending:
+                os.remove(path)
+            self._pending = []
+
+    def _apply(self, counts):
+        with self.app.app_context():
+            db.session.execute(
+                text("UPDATE video SET views = views + :count WHERE video_id = :video_id"),
+                [{'video_id': video_id, 'count': count} for video_id, count in counts.items()],
+            )
+            analytics.record_views(counts)
+            db.session.commit()
+
+    def recover(self):
+        """Apply logs left behind by processes that exited without flushing."""
+        for path in glob.glob(os.path.join(self.folder, 'views.*')):
+            owner = _owner(os.path.basename(path))
+            pid = int(owner.split('-')[0])
+            # Another log under our own pid was written before the pid was reused
+            if owner == self._name or (pid != self._pid and pid_alive(pid)):
+                continue
+            # Logs claimed by a recoverer that died themselves are claimed again
+            claimed = path.split('.recovering.')[0] + f'.recovering.{self._name}'
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue  # another process got there first
+            with open(claimed, encoding='utf-8') as f:
+                counts = Counter(line.strip() for line in f if line.strip())
+            if counts:
+                self._apply(counts)
+            os.remove(claimed)